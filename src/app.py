@@ -3,11 +3,12 @@ import flask
 import flask_security
 import numpy as np
 import werkzeug.utils
-import pandas
+import werkzeug.wsgi
 
 
 from app_object import flask_app as _app
 import database
+from database import export_cache
 import transform
 import rest_api
 import security
@@ -91,12 +92,27 @@ def view_database(db_id):
     if not table_data.is_user_auth(flask_security.current_user):
         return flask.abort(403)
 
-    df = datatable.get_data()
-
     if flask.request.method == 'POST':
         op = flask.request.form.get('opinfo', '')
         column_name = flask.request.form.get('colinfo', '')
 
+        if op == 'deduplication':
+            column_id = datatable.schema().name_to_id.get(column_name)
+            if column_id is None:
+                return flask.abort(400)
+
+            # Run it in the background, the page shows the result when it is done
+            method = flask.request.form.get('method', 'levenshtein')
+            if method != 'levenshtein' and method not in transform.KEY_METHODS:
+                return flask.abort(400)
+            threshold = int(flask.request.form.get('edit_distance', '')) if method == 'levenshtein' else 0
+            job = database.DedupJob(database.DataColumn.query.get(column_id), threshold, method)
+            job.start()
+            return flask.redirect(flask.url_for('view_database', db_id=db_id, dedup_job=job.id))
+
+        # Transforms work on the whole table, loaded compactly
+        df = datatable.get_data(compact=True)
+
         if op == 'findreplace':
             find = flask.request.form.get('Find', '')
             replace = flask.request.form.get('Replace', '')
@@ -151,26 +167,6 @@ def view_database(db_id):
             operation = flask.request.form.get('radio', '')
             df = transform.extract_from_datetime(df, column_name, operation[5: len(operation)])
 
-        elif op == 'deduplication':
-            threshold = int(flask.request.form.get('edit_distance', ''))
-            duplicates = transform.find_duplicates(df, column_name, threshold)
-
-            graph_data = []
-            for column in datatable.columns.all():
-                raw_data = datatable.get_data_raw()
-                if pandas.api.types.is_numeric_dtype(raw_data[str(column.id)]):
-                    graph_data.append([str(x) for x in transform.discretize_equiwidth(raw_data, str(column.id), 15)[
-                        str(column.id)].value_counts().tolist()])
-                else:
-                    graph_data.append(["1" for x in range(15)])
-
-            return flask.render_template('./Tables/index.html',
-                                         cols=df.columns.values.tolist(),
-                                         _dbname=db_id,
-                                         duplicates=duplicates, col=column_name,
-                                         logged=flask_security.current_user.is_authenticated,
-                                         table_id=datatable.id)
-
         elif op == 'dedupe_result':
             nr_strings = int(flask.request.form.get('nr_strings', '0'))
             chain = flask.request.form.get('chain', '') == 'on'
@@ -190,21 +186,18 @@ def view_database(db_id):
         return flask.redirect(flask.request.url)
 
     elif flask.request.method == 'GET':
-        graph_data = []
-        for column in datatable.columns.all():
-            raw_data = datatable.get_data_raw()
-            if pandas.api.types.is_numeric_dtype(raw_data[str(column.id)]):
-                graph_data.append([str(x) for x in transform.discretize_equiwidth(raw_data, str(column.id), 15)[str(column.id)].value_counts().tolist()])
-            else:
-                graph_data.append(["1" for x in range(15)])
-            # print(graph_data[len(graph_data) - 1])
+        if 'dedup_job' in flask.request.args:
+            return _dedup_job_page(db_id, datatable, flask.request.args['dedup_job'])
+
+        graph_data = _graph_data(datatable)
 
         # Get the 5 (or less) last entries in the history
         versions = table_data.versions.all()
         history = [versions[entry - 1].description for entry in range(len(versions), max(0, len(versions) - 5), -1)]
 
+        # The rows are fetched page by page by the client, the page itself only needs the column names
         return flask.render_template('./Tables/index.html',
-                                     cols=df.columns.values.tolist(),
+                                     cols=datatable.schema().column_names,
                                      graph_data=graph_data,
                                      _dbname=db_id,
                                      logged=flask_security.current_user.is_authenticated,
@@ -212,6 +205,61 @@ def view_database(db_id):
                                      history=history)
 
 
+def _dedup_job_page(db_id, datatable: database.DataTable, job_id: str):
+    """
+    Render the table page with the result of a deduplication job, or a page that waits for it
+    :param db_id: ID of the database
+    :param datatable: Table that is shown
+    :param job_id: ID of the job
+    :return: Rendered page
+    """
+    job: database.DedupJob = database.DedupJob.query.get(int(job_id)) if job_id.isdigit() else None
+    if job is None or job.table_id != datatable.id:
+        return flask.abort(404)
+
+    job.fail_if_stale(_app.config.get("DEDUP_HEARTBEAT", 30))
+    if not job.finished:
+        return flask.render_template('./Tables/index.html',
+                                     cols=datatable.schema().column_names,
+                                     _dbname=db_id,
+                                     dedup_pending=True,
+                                     logged=flask_security.current_user.is_authenticated,
+                                     table_id=datatable.id)
+
+    # Only the biggest clusters fit on a page, the rest can be paged through with the API
+    return flask.render_template('./Tables/index.html',
+                                 cols=datatable.schema().column_names,
+                                 _dbname=db_id,
+                                 duplicates=job.neighbours(_app.config.get("DEDUP_PAGE_SIZE", 100)),
+                                 duplicates_total=job.cluster_count,
+                                 col=job.column_name,
+                                 logged=flask_security.current_user.is_authenticated,
+                                 table_id=datatable.id)
+
+
+def _graph_data(datatable: database.DataTable) -> list:
+    """
+    Get the histograms of all columns for the sparklines, from the statistics stored with the table
+    :param datatable: Table to get the histograms of
+    :return: List with a list of bin counts (as strings) per column
+    """
+    columns = datatable.columns.all()
+    if any(column.statistics is None for column in columns):
+        # Table was written before statistics were kept, compute them once in the database
+        datatable.update_statistics()
+        database.db.session.commit()
+
+    graph_data = []
+    for column in columns:
+        histogram = column.statistics.get("histogram")
+        if histogram:
+            graph_data.append([str(x) for x in histogram["counts"]])
+        else:
+            graph_data.append(["1" for x in range(15)])
+
+    return graph_data
+
+
 @_app.route('/tables')
 @flask_security.login_required
 def tables_base():
@@ -223,7 +271,7 @@ def tables_base():
 def settings_base():
     return flask.render_template('./Settings/index.html',
                                  user=flask_security.current_user,
-                                 admin=flask_security.current_user.has_role(database.Role.query.get(0)),
+                                 admin=flask_security.current_user.has_role(0),
                                  users=database.User.query.all(),
                                  logged=flask_security.current_user.is_authenticated)
 
@@ -302,8 +350,19 @@ def upload_base():
         return flask.redirect(flask.request.url)
 
 
+# Options of a CSV download, COPY supports no others
+_CSV_OPTIONS = ["sep", "header", "na_rep", "gzip"]
+
+
 @_app.route("/database/download/<data_id>/")
 def download(data_id):
+    """
+    Download the latest version of a data set. ?format=arrow (or the Accept header) gives an Arrow IPC
+    stream, everything else is CSV with the options sep, header, na_rep and gzip. Other options answer
+    400 Bad Request.
+    :param data_id: ID of the data
+    :return: Response with the export
+    """
     data: database.Data = database.Data.query.get(data_id)
 
     if data is None:
@@ -316,12 +375,73 @@ def download(data_id):
         kwargs[option] = flask.request.args[option]
 
     table: database.DataTable = data.get_latest_version().tables.first()
-    try:
-        table.save(None, **kwargs)
-    except Exception:
-        flask.abort(500)
+    name = os.path.splitext(table.name)[0]
 
-    return flask.send_file(table.file_name())
+    # Columnar Arrow IPC stream, if asked for with ?format=arrow or the Accept header
+    arrow = kwargs.pop("format", None) == "arrow"
+    if arrow or flask.request.accept_mimetypes.best == database.DataTable.ARROW_MIMETYPE:
+        return _export_response(table, "arrow", {}, table.iter_arrow, database.DataTable.ARROW_MIMETYPE,
+                                name + ".arrow")
+
+    # Everything else is CSV, copied straight from the database into the response
+    if any(option not in _CSV_OPTIONS for option in kwargs):
+        flask.abort(400)
+    compress = rest_api._bool(kwargs.get("gzip"))
+    options = {
+        "sep": kwargs.get("sep", ","),
+        "header": rest_api._bool(kwargs.get("header", "1")),
+        "na_rep": kwargs.get("na_rep", "")
+    }
+
+    return _export_response(table, "csv.gz" if compress else "csv", options,
+                            lambda: table.iter_csv(compress, **options),
+                            "application/gzip" if compress else "text/csv",
+                            name + (".csv.gz" if compress else ".csv"))
+
+
+def _export_response(table: database.DataTable, export_format: str, options: dict, make_chunks,
+                     mimetype: str, filename: str) -> flask.Response:
+    """
+    Respond with an export of a table, served from the export cache when it was made before
+    :param table: Table to export
+    :param export_format: Format name, part of the cache key
+    :param options: Options that change the exported bytes, part of the cache key
+    :param make_chunks: Function that starts the export and returns its chunks
+    :param mimetype: Mimetype of the export
+    :param filename: Name of the downloaded file
+    :return: Response with the export
+    """
+    key = export_cache.export_key(table, export_format, **options)
+    headers = {"Content-Disposition": "attachment; filename=\"%s\"" % filename}
+
+    # The client still has this exact export
+    if flask.request.if_none_match.contains(key):
+        response = flask.Response(status=304, headers=headers)
+        response.set_etag(key)
+        return response
+
+    response = None
+    path = export_cache.cached_path(key)
+    if path:
+        try:
+            file = open(path, "rb")
+            response = flask.Response(werkzeug.wsgi.wrap_file(flask.request.environ, file), mimetype=mimetype,
+                                      headers=headers, direct_passthrough=True)
+            response.content_length = os.fstat(file.fileno()).st_size
+        except OSError:
+            # Evicted in the meantime, export again
+            response = None
+
+    if response is None:
+        try:
+            chunks = make_chunks()
+        except database.TableError:
+            flask.abort(406 if export_format == "arrow" else 400)
+        response = flask.Response(flask.stream_with_context(export_cache.store(key, chunks)), mimetype=mimetype,
+                                  headers=headers)
+
+    response.set_etag(key)
+    return response
 
 
 # Setup
@@ -334,6 +454,8 @@ _app.register_blueprint(rest_api.restful_blueprint)
 # Init the database and security
 database.init_app(_app)
 security.init_app(_app)
+# Jobs that were running when the server last stopped never finish
+database.fail_stale_dedup_jobs(_app)
 
 
 # WSGI support
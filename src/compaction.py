@@ -0,0 +1,192 @@
+import typing
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+""" Compacting """
+
+
+# Narrowest first
+_integer_types = [("Int8", np.int8), ("Int16", np.int16), ("Int32", np.int32), ("Int64", np.int64)]
+
+# Strings stay categorical with at most this many distinct values, in total and per value
+MAX_CATEGORIES = 10000
+CATEGORY_RATIO = 0.05
+
+
+def _compact_integers(series: pd.Series) -> pd.Series:
+    """Integers in the narrowest nullable type that holds them all"""
+    values = series.dropna()
+    if len(values) == 0:
+        return series.astype("Int8")
+
+    low, high = values.min(), values.max()
+    for name, numpy_type in _integer_types:
+        info = np.iinfo(numpy_type)
+        if info.min <= low and high <= info.max:
+            return series.astype(name)
+    return series.astype("Int64")
+
+
+def _compact_floats(series: pd.Series) -> pd.Series:
+    """Floats in single precision when that loses nothing"""
+    series = series.astype("float64")
+    narrow = series.astype("float32")
+    return narrow if narrow.astype("float64").equals(series) else series
+
+
+def _strings(series: pd.Series) -> pd.Series:
+    """Strings as Arrow backed strings if available"""
+    try:
+        return series.astype("string[pyarrow]")
+    except (TypeError, ValueError, ImportError):
+        # Older pandas or no pyarrow, they stay Python objects
+        return series.astype(object)
+
+
+def _combine_numbers(pieces: typing.List[pd.Series]) -> pd.Series:
+    """Concatenate pieces of a number column, in the widest type any of them needed"""
+    names = {str(piece.dtype) for piece in pieces}
+    if len(names) > 1:
+        order = [name for name, _ in _integer_types] + ["float32", "float64"]
+        widest = max(names, key=order.index)
+        pieces = [piece.astype(widest) for piece in pieces]
+    return pd.concat(pieces, ignore_index=True)
+
+
+def compact_chunks(chunks: typing.Iterable[pd.DataFrame], kinds: typing.Dict[str, str],
+                   category_ratio: float = CATEGORY_RATIO,
+                   max_categories: int = MAX_CATEGORIES) -> typing.Optional[pd.DataFrame]:
+    """
+    Put the chunks of a table together in types that take less memory, only one chunk is ever held
+    in plain types. Strings with few distinct values become categoricals, other strings Arrow backed
+    strings, integers the narrowest nullable integer type and floats single precision when that
+    loses nothing.
+    :param chunks: Chunks of the table, as read from the database
+    :param kinds: Kind of every column in the database: integer, float, boolean, string or datetime.
+    Pandas reads integers with nulls as floats and columns that are all null as objects, so the
+    types of a chunk do not tell.
+    :param category_ratio: Strings stay categorical with at most this many distinct values per value
+    :param max_categories: Strings stay categorical with at most this many distinct values
+    :return: The compacted table, None when there were no chunks
+    """
+    columns = None
+    pieces: typing.Dict[str, typing.List[pd.Series]] = {}
+    categories: typing.Dict[str, set] = {}
+    values: typing.Dict[str, int] = {}
+
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+            pieces = {name: [] for name in columns}
+            categories = {name: set() for name in columns if kinds.get(name) == "string"}
+            values = {name: 0 for name in categories}
+
+        for name in columns:
+            series: pd.Series = chunk[name]
+            kind = kinds.get(name)
+
+            if kind == "integer":
+                series = _compact_integers(series)
+            elif kind == "float":
+                series = _compact_floats(series)
+            elif kind == "boolean":
+                series = series.astype("boolean")
+            elif kind == "datetime":
+                series = pd.to_datetime(series)
+            elif name in categories:
+                values[name] += int(series.count())
+                series = series.astype("category")
+                categories[name].update(series.cat.categories)
+                if len(categories[name]) > max_categories:
+                    # Too many to be worth it, what was categorical so far becomes strings as well
+                    del categories[name]
+                    pieces[name] = [_strings(piece) for piece in pieces[name]]
+                    series = _strings(series.astype(object))
+            elif kind == "string":
+                series = _strings(series)
+
+            pieces[name].append(series)
+
+    if columns is None:
+        return None
+
+    combined = {}
+    for name in columns:
+        column_pieces = pieces.pop(name)
+        kind = kinds.get(name)
+
+        if name in categories:
+            column = pd.Series(union_categoricals(column_pieces))
+            if len(categories[name]) > category_ratio * values[name]:
+                column = _strings(column)
+        elif kind in ["integer", "float"]:
+            column = _combine_numbers(column_pieces)
+        else:
+            column = pd.concat(column_pieces, ignore_index=True)
+
+        combined[name] = column
+
+    return pd.DataFrame(combined, columns=columns)
+
+
+def compact(dataframe: pd.DataFrame, kinds: typing.Dict[str, str], category_ratio: float = CATEGORY_RATIO,
+            max_categories: int = MAX_CATEGORIES) -> pd.DataFrame:
+    """
+    Make a dataframe that is already in memory take less memory, see compact_chunks
+    :param dataframe: Dataframe to compact
+    :param kinds: Kind of every column in the database
+    :param category_ratio: Strings stay categorical with at most this many distinct values per value
+    :param max_categories: Strings stay categorical with at most this many distinct values
+    :return: The compacted dataframe
+    """
+    return compact_chunks([dataframe], kinds, category_ratio, max_categories)
+
+
+""" Expanding """
+
+
+def expand_series(series: pd.Series, nullable: bool = False) -> pd.Series:
+    """
+    Turn a compacted column back into the type pandas reads it as from the database
+    :param series: Column, compacted or not
+    :param nullable: Keep integers with missing values as Int64 instead of floats, for writing them
+    :return: Column with a plain numpy type
+    """
+    name = str(series.dtype)
+
+    if name in ["category", "string", "boolean"]:
+        if name == "boolean" and not series.hasnans:
+            return series.astype(bool)
+        # Missing values are None, like in a column read from the database
+        expanded = series.astype(object)
+        expanded[series.isna()] = None
+        return expanded
+    elif name.startswith("Int") or name.startswith("UInt"):
+        if series.hasnans:
+            return series.astype("Int64" if nullable else "float64")
+        return series.astype("int64")
+    elif name == "float32":
+        return series.astype("float64")
+
+    return series
+
+
+def expand(dataframe: pd.DataFrame, columns: typing.Iterable[str] = None, nullable: bool = False) -> pd.DataFrame:
+    """
+    Expand compacted columns of a dataframe, for code that works on plain numpy types
+    :param dataframe: Dataframe to expand, changed in place
+    :param columns: Columns to expand, all by default
+    :param nullable: Keep integers with missing values as Int64, see expand_series
+    :return: The expanded dataframe
+    """
+    for name in (dataframe.columns if columns is None else columns):
+        if name in dataframe:
+            col = dataframe[name]
+            expanded = expand_series(col, nullable)
+            if expanded is not col:
+                dataframe[name] = expanded
+
+    return dataframe
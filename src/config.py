@@ -36,6 +36,39 @@ class BaseConfig(object):
     # Disable csrf protection
     WTF_CSRF_ENABLED = False
 
+    # Adaptive indexing of user tables
+    # Uses of a column (sort, filter, join) before it gets an index
+    INDEX_USAGE_THRESHOLD = 5
+    # Tables with less rows than this are never indexed
+    INDEX_MIN_ROWS = 10000
+    # Maximum amount of bytes all indexes on user tables may take together
+    INDEX_STORAGE_BUDGET = 512 * 1024 * 1024
+
+    # Cache of exported tables, least recently used files go first when it is full
+    EXPORT_CACHE_FOLDER = "local/exports/"
+    EXPORT_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+
+    # HTTP caching of API resources for immutable versions
+    # Seconds clients may use a response before checking back with its ETag
+    HTTP_CACHE_MAX_AGE = 0
+    # Maximum total size of response bodies kept in memory
+    RESPONSE_CACHE_SIZE = 64 * 1024 * 1024
+
+    # Amount of duplicate clusters shown at once on the table page
+    DEDUP_PAGE_SIZE = 100
+    # Processes a deduplication job compares strings with, 1 compares them in the job's own thread
+    DEDUP_WORKERS = 2
+    # Seconds between the heartbeats of a running deduplication job, a job that misses a few counts as failed
+    DEDUP_HEARTBEAT = 30
+    # Maximum amount of bytes the stored similarity graphs of deduplication jobs may take together,
+    # least recently used graphs go first
+    SIMILARITY_INDEX_SIZE = 1024 * 1024 * 1024
+
+    # Transformations on tables with more rows than this stream through in chunks instead of loading the table
+    CHUNKED_TRANSFORM_ROWS = 5000000
+    # Rows per chunk of a chunked transformation
+    TRANSFORM_CHUNK_SIZE = 65536
+
 
 class LocalConfig(BaseConfig):
 
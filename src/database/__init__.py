@@ -1,15 +1,17 @@
 import sqlalchemy.schema
+import sqlalchemy.exc
 import sqlalchemy.ext.compiler
 import flask_security.utils
 
 from .db_object import db
-from .user import User
+from .user import User, clear_role_caches
 from .role import Role
 
 from .data import Data
 from .data_version import DataVersion
 from .data_table import DataTable
 from .data_column import DataColumn
+from .dedup_job import DedupJob, DedupCluster, fail_stale_jobs
 
 from .exceptions import *
 
@@ -24,6 +26,17 @@ def _compile_drop_table(element, compiler, **kwargs):
 def init_app(app):
     db.init_app(app)
 
+    # Roles are cached on the loaded users, never let them outlive a request
+    app.before_request(clear_role_caches)
+
+
+def fail_stale_dedup_jobs(app) -> None:
+    try:
+        fail_stale_jobs(app.config.get("DEDUP_HEARTBEAT", 30))
+    except sqlalchemy.exc.DBAPIError:
+        # The tables do not exist yet, there are no jobs either
+        db.session.rollback()
+
 
 def create_all(*args, **kwargs):
     db.create_all(*args, **kwargs)
@@ -35,6 +48,14 @@ def setup_schemas():
     db.session.connection().execute(sqlalchemy.schema.CreateSchema("tables"))
     db.session.commit()
 
+    try:
+        # Trigram indexes on user tables need this, see column_index
+        db.session.connection().execute("CREATE EXTENSION IF NOT EXISTS pg_trgm ;")
+        db.session.commit()
+    except sqlalchemy.exc.DBAPIError:
+        # Not allowed to create extensions, trigram indexes will simply not be built
+        db.session.rollback()
+
 
 def create_admin_user() -> User:
     admin = User(id=0, username="admin", password=flask_security.utils.hash_password("admin"))
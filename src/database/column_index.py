@@ -0,0 +1,199 @@
+import collections
+import threading
+import typing
+import re
+
+import flask
+import sqlalchemy.exc
+
+from .db_object import db
+
+if typing.TYPE_CHECKING:
+    from .data_table import DataTable
+
+
+# Ways a column can be used in a query, and the index method that helps it
+USAGE_METHODS = {
+    "sort": "btree",
+    "filter": "btree",
+    "join": "btree",
+    "search": "trgm",
+}
+
+# Usage counters per (table id, column id, method)
+_usage: typing.Dict[typing.Tuple[int, int, str], int] = collections.Counter()
+# Indexes that are being built or are known to exist
+_indexed: typing.Set[typing.Tuple[int, int, str]] = set()
+# Indexes that could not be built, do not try these again
+_failed: typing.Set[typing.Tuple[int, int, str]] = set()
+
+_lock: threading.Lock = threading.Lock()
+
+_re_index_name = re.compile(r"ix_(\d+)_(\d+)_(btree|trgm)")
+
+
+def index_name(table_id: int, column_id: int, method: str) -> str:
+    """
+    Get the name of the index on a column of a user table
+    :param table_id: ID of the table
+    :param column_id: ID of the column
+    :param method: Index method, btree or trgm
+    :return: Name of the index
+    """
+    return "ix_%s_%s_%s" % (table_id, column_id, method)
+
+
+def record_usage(table: "DataTable", column_ids: typing.Iterable[int], kind: str) -> None:
+    """
+    Register that columns of a table were used for sorting, filtering, joining or searching.
+    When a column gets hot enough, an index is built for it in the background.
+    :param table: Table the columns belong to
+    :param column_ids: IDs of the used columns
+    :param kind: One of the keys of USAGE_METHODS
+    """
+    method = USAGE_METHODS[kind]
+    threshold = flask.current_app.config.get("INDEX_USAGE_THRESHOLD", 5)
+
+    to_build = []
+    with _lock:
+        for column_id in column_ids:
+            if column_id is None:
+                continue
+            key = (table.id, int(column_id), method)
+            _usage[key] += 1
+            if _usage[key] >= threshold and key not in _indexed and key not in _failed:
+                _indexed.add(key)
+                to_build.append(key)
+
+    if len(to_build) == 0:
+        return
+
+    # Index creation can take a while on big tables, do not let the request wait on it
+    app = flask.current_app._get_current_object()
+    thread = threading.Thread(target=_build_indexes, args=(app, to_build), daemon=True)
+    thread.start()
+
+
+def forget(table_id: int) -> None:
+    """
+    Forget all usage statistics of a table, used when its physical table is dropped or replaced
+    :param table_id: ID of the table
+    """
+    with _lock:
+        for key in [key for key in _usage if key[0] == table_id]:
+            del _usage[key]
+        _indexed.difference_update([key for key in _indexed if key[0] == table_id])
+        _failed.difference_update([key for key in _failed if key[0] == table_id])
+
+
+def _is_superseded(table: "DataTable") -> bool:
+    """
+    Check if a table is no longer (or will soon no longer be) part of the latest version of its data
+    :param table: Table to check
+    :return: Table is superseded
+    """
+    if table is None or not table.loaded:
+        return True
+
+    latest = table.version.data.get_latest_version()
+    return latest is None or latest.id != table.version_id
+
+
+def _estimate_rows(connection, table: "DataTable") -> int:
+    """
+    Get the planner estimate of the amount of rows in a table
+    :param connection: Connection to use
+    :param table: Table to estimate
+    :return: Estimated amount of rows
+    """
+    q = db.text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name) ;")
+    result = connection.execute(q, name="tables.\"%s\"" % table.sql_table_name()).scalar()
+    return int(result) if result else 0
+
+
+def _build_indexes(app: flask.Flask, keys: list) -> None:
+    """
+    Build the indexes for the given (table id, column id, method) keys, then enforce the storage budget.
+    Runs in a background thread.
+    """
+    from .data_table import DataTable
+
+    with app.app_context():
+        # CREATE INDEX CONCURRENTLY cannot run inside of a transaction
+        connection = db.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            for key in keys:
+                table_id, column_id, method = key
+                table: DataTable = DataTable.query.get(table_id)
+
+                # Never spend work on tables that are replaced by a newer version
+                if _is_superseded(table) or _estimate_rows(connection, table) < app.config.get("INDEX_MIN_ROWS", 0):
+                    with _lock:
+                        _indexed.discard(key)
+                    continue
+
+                if method == "trgm":
+                    using = "gin (\"%s\" gin_trgm_ops)" % column_id
+                else:
+                    using = "btree (\"%s\")" % column_id
+
+                q = db.text("CREATE INDEX CONCURRENTLY IF NOT EXISTS \"%s\" ON tables.\"%s\" USING %s ;" %
+                            (index_name(table_id, column_id, method), table.sql_table_name(), using))
+                try:
+                    connection.execute(q)
+                except sqlalchemy.exc.DBAPIError:
+                    # Unsupported column type for the method, missing pg_trgm, table dropped meanwhile, ...
+                    # A failed concurrent build leaves an invalid index behind, clean it up
+                    connection.execute(db.text("DROP INDEX CONCURRENTLY IF EXISTS tables.\"%s\" ;" %
+                                               index_name(table_id, column_id, method)))
+                    with _lock:
+                        _indexed.discard(key)
+                        _failed.add(key)
+
+            _enforce_budget(connection, app.config.get("INDEX_STORAGE_BUDGET", 0))
+        finally:
+            connection.close()
+            db.session.remove()
+
+
+def _enforce_budget(connection, budget: int) -> None:
+    """
+    Drop indexes on user tables until they fit in the storage budget.
+    Indexes on superseded tables go first, then the least used ones.
+    :param connection: Autocommit connection to use
+    :param budget: Maximum total size of the indexes in bytes
+    """
+    from .data_table import DataTable
+
+    q = db.text(
+        "SELECT c.relname, pg_relation_size(c.oid) "
+        "FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = 'tables' ;"
+    )
+
+    indexes = []
+    for name, size in connection.execute(q):
+        match = _re_index_name.fullmatch(name)
+        if not match:
+            continue
+        key = (int(match[1]), int(match[2]), match[3])
+        superseded = _is_superseded(DataTable.query.get(key[0]))
+        indexes.append((not superseded, _usage.get(key, 0), key, name, size))
+
+    total = sum(index[4] for index in indexes)
+    if total <= budget:
+        return
+
+    # Sort so the first entries are the ones we want to lose first
+    for _, _, key, name, size in sorted(indexes, key=lambda index: index[:2]):
+        connection.execute(db.text("DROP INDEX CONCURRENTLY IF EXISTS tables.\"%s\" ;" % name))
+        with _lock:
+            _indexed.discard(key)
+            # Start counting again, so it only comes back when it is really needed
+            _usage.pop(key, None)
+
+        total -= size
+        if total <= budget:
+            break
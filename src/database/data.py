@@ -3,6 +3,7 @@ import uuid
 import threading
 import os
 
+from . import similarity_index
 from .db_object import db, table_names
 from .exceptions import DataError
 
@@ -20,6 +21,7 @@ def delete_data(data_id: int) -> None:
 
     # Clear all versions of the data
     data.clear()
+    similarity_index.remove_all(data)
     # Delete the data
     db.session.delete(data)
     db.session.commit()
@@ -204,7 +206,7 @@ class Data(db.Model):
         :param user: User to check.
         :return User has access to this data
         """
-        return user.has_role(self.access_role)
+        return user.has_role(self.access_role_id)
 
     def is_user_owner(self, user: "User") -> bool:
         """
@@ -212,7 +214,7 @@ class Data(db.Model):
         :param user: User to check
         :return User is an owner
         """
-        return user.has_role(self.admin_role)
+        return user.has_role(self.admin_role_id)
 
     def get_latest_version(self) -> "DataVersion":
         """
@@ -245,6 +247,8 @@ class Data(db.Model):
 
         if len(self.versions.all()) > 1:
             delete_version(self.get_latest_version().id)
+            # Graphs of columns that only existed in the removed version are of no use anymore
+            similarity_index.remove_unused(self)
 
     def clear(self) -> None:
         """
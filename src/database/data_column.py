@@ -1,5 +1,6 @@
 import sqlalchemy
 import typing
+import numpy
 import pandas
 
 from .db_object import db, table_names
@@ -8,6 +9,37 @@ if typing.TYPE_CHECKING:
     from .data_table import DataTable
 
 
+def column_statistics(series: pandas.Series, bins: int = 15) -> dict:
+    """
+    Compute the summary statistics of a column, with a histogram for numeric columns
+    :param series: Data of the column
+    :param bins: Amount of equal width bins in the histogram
+    :return: JSON serializable statistics
+    """
+    values = series.dropna()
+    statistics = {
+        "count": int(len(series)),
+        "nulls": int(len(series) - len(values)),
+        "distinct": int(values.nunique()),
+    }
+
+    if pandas.api.types.is_numeric_dtype(series) and not pandas.api.types.is_bool_dtype(series):
+        values = values.astype("float64")
+        values = values[numpy.isfinite(values)]
+
+        if len(values) > 0:
+            counts, edges = numpy.histogram(values, bins=bins)
+            statistics.update({
+                "min": float(values.min()),
+                "max": float(values.max()),
+                "mean": float(values.mean()),
+                "std": float(values.std()) if len(values) > 1 else None,
+                "histogram": {"counts": [int(x) for x in counts], "edges": [float(x) for x in edges]},
+            })
+
+    return statistics
+
+
 class DataColumn(db.Model):
     """Column in a Table in a user database"""
     # Save everything in the data_table_columns table
@@ -25,6 +57,8 @@ class DataColumn(db.Model):
     # --------------------------------------------
     # What column?
     name = db.Column(db.String, nullable=False)
+    # Summary statistics and histogram, computed when the table is written, see column_statistics
+    statistics = db.Column(db.JSON, nullable=True, default=None)
 
     # Settings
     # ----------------------------------------------------------------
@@ -74,6 +108,15 @@ class DataColumn(db.Model):
         """
         return db.select([self.sql_column_clause()]).select_from(self.table.sql_table_clause())
 
+    def iter_values(self, chunk_size: int = 65536) -> typing.Iterator[pandas.Series]:
+        """
+        Iterate over the values of this column in chunks, without loading the whole column
+        :param chunk_size: Amount of values per chunk
+        :return: Generator of series
+        """
+        for dataframe in self.table.iter_dataframes(self.select_raw(), chunk_size):
+            yield dataframe.iloc[:, 0]
+
     def get_data(self) -> pandas.DataFrame:
         """
         Get the dataframe with only this columns data
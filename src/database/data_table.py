@@ -1,13 +1,25 @@
 import typing
 import os
 import re
+import queue
+import threading
+import zlib
 
 import sqlalchemy
+import sqlalchemy.dialects.postgresql
+import numpy
 import pandas
 import psycopg2
 
+try:
+    import pyarrow
+except ImportError:
+    # Optional, only needed for the Arrow IPC wire format
+    pyarrow = None
+
 from .db_object import db, table_names
 from .exceptions import *
+from . import column_index
 
 if typing.TYPE_CHECKING:
     from .data_version import DataVersion
@@ -24,6 +36,7 @@ def delete_table(table_id: int) -> bool:
     if table:
         # Clear the data
         table.clear()
+        table.forget_schema()
         # Delete
         db.session.delete(table)
         db.session.commit()
@@ -34,14 +47,14 @@ def delete_table(table_id: int) -> bool:
 
 def join_tables(table_ids: list, *args) -> sqlalchemy.sql.expression.FromClause:
     """"""
-    from .data_column import DataColumn
-
     tables: list = [DataTable.query.get(table_id) for table_id in table_ids]
 
     if None in tables:
         # If there are invalid ids for tables, fail
         raise JoinError()
 
+    clauses = [table.sql_table_clause() for table in tables]
+
     # Check if the column ids are valid
     for l in args:
         # If the argument is not a list, fail
@@ -52,41 +65,48 @@ def join_tables(table_ids: list, *args) -> sqlalchemy.sql.expression.FromClause:
             raise JoinError("Columns to join do not match amount of tables")
         # Check if the columns actually belong in the right tables
         for i in range(len(l)):
-            if tables[i].columns.filter(DataColumn.id == l[i]).count() <= 0 and l[i] is not None:
+            if l[i] is not None and str(l[i]) not in clauses[i].columns:
                 raise JoinError("Column to match is not part of the table being joined")
 
     # Start the join clause with the first table
-    join_clause = tables[0].sql_table_clause()
+    join_clause = clauses[0]
 
     # Generate the join statement
     for table_i in range(len(table_ids) - 1):
         table1: DataTable = tables[table_i]
         table2: DataTable = tables[(table_i + 1) % len(table_ids)]
+        table1_clause = clauses[table_i]
+        table2_clause = clauses[(table_i + 1) % len(table_ids)]
 
-        clauses = []
+        on_clauses = []
         for and_i in range(len(args)):
             # Check if both are valid, else there is a None so we don't join on this
             if args[and_i][table_i] and args[and_i][(table_i + 1) % len(table_ids)]:
-                column1_clause = table1.sql_table_clause().columns[
+                column1_clause = table1_clause.columns[
                     str(args[and_i][table_i])
                 ]
-                column2_clause = table2.sql_table_clause().columns[
+                column2_clause = table2_clause.columns[
                     str(args[and_i][(table_i + 1) % len(table_ids)])
                 ]
-                clauses.append(column1_clause == column2_clause)
+                on_clauses.append(column1_clause == column2_clause)
                 # print("success")
             else:
                 # print("fail")
                 pass
 
-        if len(clauses) > 0:
-            and_clause = sqlalchemy.sql.expression.and_(*clauses)
+        # Remember the join keys, so they get indexed when joined on often
+        column_index.record_usage(table1, [args[and_i][table_i] for and_i in range(len(args))], "join")
+        column_index.record_usage(table2, [args[and_i][(table_i + 1) % len(table_ids)] for and_i in range(len(args))],
+                                  "join")
+
+        if len(on_clauses) > 0:
+            and_clause = sqlalchemy.sql.expression.and_(*on_clauses)
 
             # Generate a full outer join with the 2
-            join_clause = join_clause.join(table2.sql_table_clause(), and_clause, full=True)
+            join_clause = join_clause.join(table2_clause, and_clause, full=True)
 
         else:
-            join_clause = join_clause.join(table2.sql_table_clause(), db.text("1=1"), full=True)
+            join_clause = join_clause.join(table2_clause, db.text("1=1"), full=True)
 
     return join_clause
 
@@ -214,11 +234,153 @@ def _match_sql_types(t: str) -> str:
         raise ValueError("Unknown SQL data type %s" % t)
 
 
+class _ChunkSink(object):
+    """Write-only file object that keeps the written bytes until they are taken"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _sql_literal(value: str) -> str:
+    """Quote a string as an SQL literal"""
+    return "'%s'" % value.replace("'", "''")
+
+
+# Arrow types of the PostgreSQL types (by oid) that user tables hold
+_arrow_types = {
+    16: "bool_", 20: "int64", 21: "int16", 23: "int32", 700: "float32", 701: "float64", 1700: "float64",
+    25: "string", 1042: "string", 1043: "string", 1082: "date32",
+}
+
+
+def _arrow_type(type_code: int):
+    """Get the Arrow type for a PostgreSQL type oid, None if there is no fixed one"""
+    if type_code in _arrow_types:
+        return getattr(pyarrow, _arrow_types[type_code])()
+    elif type_code == 1114:
+        return pyarrow.timestamp("us")
+    elif type_code == 1184:
+        return pyarrow.timestamp("us", tz="UTC")
+    elif type_code == 1083:
+        return pyarrow.time64("us")
+    return None
+
+
+# Types of the columns of user tables, by information_schema name: the type to create them with again
+# and the kind of values they hold, see compaction.compact_chunks
+_sql_types = {
+    "smallint": (sqlalchemy.types.SmallInteger(), "integer"),
+    "integer": (sqlalchemy.types.Integer(), "integer"),
+    "bigint": (sqlalchemy.types.BigInteger(), "integer"),
+    "real": (sqlalchemy.types.REAL(), "float"),
+    "double precision": (sqlalchemy.types.Float(precision=53), "float"),
+    "numeric": (sqlalchemy.types.Numeric(), "float"),
+    "boolean": (sqlalchemy.types.Boolean(), "boolean"),
+    "text": (sqlalchemy.types.Text(), "string"),
+    "character varying": (sqlalchemy.types.String(), "string"),
+    "character": (sqlalchemy.types.String(), "string"),
+    "date": (sqlalchemy.types.Date(), None),
+    "time without time zone": (sqlalchemy.types.Time(), None),
+    "timestamp without time zone": (sqlalchemy.types.DateTime(), "datetime"),
+    "timestamp with time zone": (sqlalchemy.types.DateTime(timezone=True), "datetime"),
+}
+
+
+def _sql_type(series: pandas.Series) -> sqlalchemy.types.TypeEngine:
+    """
+    Get the type to store a column with, like pandas.to_sql picks it but the same for compacted columns
+    :param series: Column, compacted or not
+    :return: SQL type
+    """
+    name = str(series.dtype)
+
+    if name in ["category", "string"]:
+        return sqlalchemy.types.Text()
+    elif name in ["bool", "boolean"]:
+        return sqlalchemy.types.Boolean()
+    elif name.lower().startswith("int") or name.lower().startswith("uint"):
+        return sqlalchemy.types.BigInteger()
+    elif name.startswith("float"):
+        return sqlalchemy.types.Float(precision=53)
+    elif name.startswith("datetime64"):
+        return sqlalchemy.types.DateTime(timezone=getattr(series.dtype, "tz", None) is not None)
+
+    kind = pandas.api.types.infer_dtype(series, skipna=True)
+    if kind == "integer":
+        return sqlalchemy.types.BigInteger()
+    elif kind in ["floating", "mixed-integer-float", "decimal"]:
+        return sqlalchemy.types.Float(precision=53)
+    elif kind == "boolean":
+        return sqlalchemy.types.Boolean()
+    elif kind == "datetime":
+        return sqlalchemy.types.DateTime()
+    elif kind == "date":
+        return sqlalchemy.types.Date()
+    elif kind == "time":
+        return sqlalchemy.types.Time()
+    return sqlalchemy.types.Text()
+
+
+class TableSchema(object):
+    """Column layout of a user table, with the clauses to build queries on it"""
+
+    def __init__(self, table_name: str, columns: typing.List[typing.Tuple[int, str]]):
+        """
+        :param table_name: Name of the table in the database
+        :param columns: (id, name) pairs of the columns, in order
+        """
+        self.column_ids: typing.List[int] = [column[0] for column in columns]
+        self.column_names: typing.List[str] = [column[1] for column in columns]
+        self.id_to_name: typing.Dict[int, str] = dict(columns)
+        self.name_to_id: typing.Dict[str, int] = {name: column_id for column_id, name in columns}
+
+        # Columns named by id, as stored in the database
+        self.table_clause = sqlalchemy.sql.expression.table(
+            table_name, *[db.column(str(column_id)) for column_id in self.column_ids]
+        )
+        self.table_clause.schema = "tables"
+
+        # Columns labeled with the names the user sees
+        self.table = sqlalchemy.sql.expression.table(
+            table_name, *[db.column(str(column_id)).label(name) for column_id, name in columns]
+        )
+        self.table.schema = "tables"
+
+
+# Schemas per table id, together with the revision they were built for
+_schemas: typing.Dict[int, typing.Tuple[int, TableSchema]] = dict()
+_schemas_lock: threading.Lock = threading.Lock()
+
+
 class DataTable(db.Model):
     """Table in a user database"""
     # Save everything in the data_tables table
     __tablename__ = table_names["DataTable"]
 
+    # Media type of the Arrow IPC stream format
+    ARROW_MIMETYPE = "application/vnd.apache.arrow.stream"
+
     # Needed for normal operation
     # ----------------------------------------------------------------
     # Give this a unique id
@@ -239,6 +401,9 @@ class DataTable(db.Model):
 
     loaded = db.Column(db.Boolean, nullable=False, default=False)
 
+    # Bumped whenever the table changes in place, versions are immutable otherwise
+    revision = db.Column(db.Integer, nullable=False, default=0)
+
     # Settings
     # ----------------------------------------------------------------
     # NOTE: these are settings like sorting order, graph type, data type, etc...
@@ -255,9 +420,50 @@ class DataTable(db.Model):
         db.session.add(self)
         db.session.commit()
 
+    def _bump_revision(self) -> None:
+        """Mark the content of this table as changed, does not commit"""
+        self.revision = (self.revision or 0) + 1
+
     def _has_data(self) -> bool:
         return len(self.columns.all()) > 0
 
+    def schema(self) -> TableSchema:
+        """
+        Get the column layout of this table, it is only read from the metadata tables
+        when the table changed since the last time
+        :return: Schema of the table
+        """
+        from .data_column import DataColumn
+
+        revision = self.revision or 0
+        with _schemas_lock:
+            cached = _schemas.get(self.id)
+        if cached and cached[0] == revision:
+            return cached[1]
+
+        columns = db.session.query(DataColumn.id, DataColumn.name) \
+            .filter(DataColumn.table_id == self.id).order_by(DataColumn.id).all()
+        schema = TableSchema(self.sql_table_name(), [(column[0], column[1]) for column in columns])
+
+        with _schemas_lock:
+            _schemas[self.id] = (revision, schema)
+
+        return schema
+
+    def forget_schema(self) -> None:
+        """Drop the cached schema, call this whenever columns are added or removed"""
+        with _schemas_lock:
+            _schemas.pop(self.id, None)
+
+    def rename(self, name: str) -> None:
+        """
+        Change the name of the table
+        :param name: New name
+        """
+        self.name = name
+        self._bump_revision()
+        self._update_db()
+
     def _import_error(self):
         raise TableError("Cannot import when there is already data present")
 
@@ -347,6 +553,8 @@ class DataTable(db.Model):
                 # print("alter")
                 return False
 
+        self.forget_schema()
+
         # print(inserts)
         for columns, data in inserts:
             # print(re_insert_names.findall(columns))
@@ -381,10 +589,11 @@ class DataTable(db.Model):
                     # with open("temp.txt", "w") as file: file.write(str(result.groups()))
                     return False
 
-        return True
-
+        self.update_statistics()
         self._update_db()
 
+        return True
+
     def init_old(self, old: "DataTable") -> dict:
         """"""
         from .data_column import DataColumn
@@ -405,7 +614,10 @@ class DataTable(db.Model):
                                                                                new_column.id))
             db.session.connection().execute(q)
             translate[column.id] = new_column.id
+            # Same data, same statistics
+            new_column.statistics = column.statistics
 
+        self.forget_schema()
         return translate
 
     def init_pandas(self, dataframe: pandas.DataFrame) -> None:
@@ -415,6 +627,14 @@ class DataTable(db.Model):
 
         self.load_data(dataframe)
 
+    def init_chunks(self, chunks: typing.Iterable[pandas.DataFrame],
+                    column_types: typing.Dict[str, sqlalchemy.types.TypeEngine] = None) -> None:
+        """"""
+        if self._has_data():
+            self._import_error()
+
+        self.load_chunks(chunks, column_types)
+
     def init_selectable(self, select: sqlalchemy.sql.expression.Select):
         from .data_column import DataColumn
 
@@ -437,11 +657,14 @@ class DataTable(db.Model):
                 )
                 db.session.connection().execute(alter_q)
 
+        self.forget_schema()
+        self.update_statistics()
         self.loaded = True
         self._update_db()
 
     def clear(self) -> None:
         """Clear the table of all data so we can init again"""
+        column_index.forget(self.id)
 
         db.session.connection().execute(
             "DROP TABLE IF EXISTS tables.\"%s\";" % self.sql_table_name()
@@ -450,6 +673,8 @@ class DataTable(db.Model):
             db.session.delete(column)
 
         self.loaded = False
+        self._bump_revision()
+        self.forget_schema()
         self._update_db()
 
     def delete_column(self, column_id: int) -> "DataTable":
@@ -470,6 +695,9 @@ class DataTable(db.Model):
 
         # Delete the column from the DB
         db.session.delete(column)
+        self._bump_revision()
+        self.forget_schema()
+        db.session.add(self)
 
         return self
 
@@ -481,11 +709,10 @@ class DataTable(db.Model):
         :param value: Value to use for predicate
         :return: self
         """
-        translate = {}
+        translate = self.schema().name_to_id
         re_columns = "(?:"
-        for column in self.columns.all():
-            re_columns += column.name + "|"
-            translate[column.name] = column.id
+        for name in translate:
+            re_columns += name + "|"
         re_columns = re_columns.rstrip("|") + ")"
 
         regex = re.compile(r"((?:(?:(?#columns)%s|(?#numbers)(?:\d+?)(?:\.\d+?)?|(?#strings)([\"\'`])(?:\\.|[^\\])*?\2)"
@@ -499,15 +726,24 @@ class DataTable(db.Model):
 
         re_banned = re.compile(r"--")
 
-        if len(re_banned.findall()) > 0:
+        if len(re_banned.findall(predicate)) > 0:
             raise TableError("Banned string found in predicate")
 
         if regex.fullmatch(predicate):
+            # Remember what columns are filtered on, pattern matches benefit from a trigram index
+            filtered = [translate[key] for key in translate if re.search(r"\b%s\b" % re.escape(key), predicate)]
+            searched = [translate[key] for key in translate if re.search(r"\b%s\s?CONTAINS" % re.escape(key), predicate)]
+            column_index.record_usage(self, filtered, "filter")
+            column_index.record_usage(self, searched, "search")
+
             for key in translate:
-                predicate = predicate.replace(key, translate[key])
+                predicate = predicate.replace(key, "\"%s\"" % translate[key])
             whereclause = db.text(predicate)
             q = db.delete(self.sql_table_clause(), whereclause)
             db.session.connection().execute(q)
+            self._bump_revision()
+            self.update_statistics()
+            self._update_db()
 
 
     def dir_name(self) -> str:
@@ -559,16 +795,10 @@ class DataTable(db.Model):
         return "table_%s" % self.id
 
     def sql_table_clause(self) -> sqlalchemy.sql.expression.TableClause:
-        columns = [c.sql_column_clause() for c in self.columns.all()]
-        table = sqlalchemy.sql.expression.table(self.sql_table_name(), *columns)
-        table.schema = "tables"
-        return table
+        return self.schema().table_clause
 
     def sql_table(self) -> sqlalchemy.sql.expression.TableClause:
-        columns = [c.sql_column() for c in self.columns.all()]
-        table = sqlalchemy.sql.expression.table(self.sql_table_name(), *columns)
-        table.schema = "tables"
-        return table
+        return self.schema().table
 
     def select_clause(self) -> sqlalchemy.sql.expression.Select:
         """
@@ -584,16 +814,296 @@ class DataTable(db.Model):
         """
         return self.sql_table().select()
 
-    def get_data(self) -> pandas.DataFrame:
+    def row_count(self) -> int:
+        """
+        Count the rows in this table, without reading them
+        :return: Amount of rows
+        """
+        q = db.select([sqlalchemy.func.count()]).select_from(self.sql_table_clause())
+        return db.session.connection().execute(q).scalar()
+
+    def row_estimate(self) -> int:
+        """
+        Get the planner estimate of the amount of rows, without counting them
+        :return: Estimated amount of rows
+        """
+        q = db.text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name) ;")
+        result = db.session.connection().execute(q, name="tables.\"%s\"" % self.sql_table_name()).scalar()
+        return int(result) if result else 0
+
+    def sample_select(self, rows: int, raw: bool = False) -> sqlalchemy.sql.expression.Select:
+        """
+        Get a select statement for a bounded sample of the table, big tables are sampled by block
+        so only a small part of them is read
+        :param rows: Maximum amount of rows in the sample
+        :param raw: Name the columns by id, as stored in the database
+        :return: Select statement for the sample
+        """
+        schema = self.schema()
+        estimate = self.row_estimate()
+
+        if estimate > 10 * rows:
+            # Ask for a few times more than needed, block sampling returns an uneven amount of rows
+            percent = min(100.0, 400.0 * rows / estimate)
+            source = sqlalchemy.sql.expression.tablesample(schema.table_clause, sqlalchemy.func.system(percent))
+        else:
+            source = schema.table_clause
+
+        if raw:
+            columns = [source.c[str(column_id)] for column_id in schema.column_ids]
+        else:
+            columns = [source.c[str(column_id)].label(name)
+                       for column_id, name in zip(schema.column_ids, schema.column_names)]
+
+        return db.select(columns).select_from(source).limit(rows)
+
+    def distinct_values(self, column_name: str, limit: int = 100) -> list:
+        """
+        Get some of the distinct values of a column, without reading the table
+        :param column_name: Name of the column
+        :param limit: Maximum amount of values
+        :return: Distinct values, nulls left out
+        """
+        column = self.sql_table_clause().c[str(self.schema().name_to_id[column_name])]
+        q = db.select([column]).where(column.isnot(None)).distinct().limit(limit)
+        return [row[0] for row in db.session.connection().execute(q)]
+
+    def iter_rows(self, q: sqlalchemy.sql.expression.Select = None, chunk_size: int = 1000) -> typing.Iterator[list]:
+        """
+        Iterate over the result of a select on this table in chunks, using a server-side cursor
+        :param q: Select statement to run, the raw table by default
+        :param chunk_size: Amount of rows to fetch at once
+        :return: Generator of lists of row tuples
+        """
+        if q is None:
+            q = self.select_clause()
+
+        # Use a separate connection, the cursor has to stay open while the caller consumes the rows
+        connection = db.engine.connect().execution_options(stream_results=True)
+        try:
+            result = connection.execute(q)
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if len(rows) == 0:
+                    break
+                yield [tuple(row) for row in rows]
+        finally:
+            connection.close()
+
+    def iter_dataframes(self, q: sqlalchemy.sql.expression.Select = None,
+                        chunk_size: int = 65536) -> typing.Iterator[pandas.DataFrame]:
+        """
+        Iterate over the result of a select on this table as dataframes, using a server-side cursor
+        :param q: Select statement to run, the table as seen by the user by default
+        :param chunk_size: Amount of rows per dataframe
+        :return: Generator of dataframes
+        """
+        if q is None:
+            q = self.select()
+
+        connection = db.engine.connect().execution_options(stream_results=True)
+        try:
+            for dataframe in pandas.read_sql_query(q, connection, chunksize=chunk_size):
+                yield dataframe
+        finally:
+            connection.close()
+
+    def iter_arrow(self, q: sqlalchemy.sql.expression.Select = None,
+                   chunk_size: int = 65536) -> typing.Iterator[bytes]:
+        """
+        Encode the result of a select on this table as an Arrow IPC stream, one record batch per chunk
+        :param q: Select statement to run, the table as seen by the user by default
+        :param chunk_size: Amount of rows per record batch
+        :return: Generator of encoded bytes
+        """
+        if pyarrow is None:
+            raise TableError("pyarrow is not installed, cannot use the Arrow format")
+
+        if q is None:
+            q = self.select()
+
+        # The types come from the database, not from the first chunk: a column that happens to be all NULL
+        # there would get the null type and break on the first chunk with values
+        arrow_types = self.result_arrow_types(q)
+
+        def generate():
+            sink = _ChunkSink()
+            writer = None
+            schema = None
+
+            for dataframe in self.iter_dataframes(q, chunk_size):
+                if writer is None:
+                    # Types the database does not pin down come from the chunk, as text when they are unknown
+                    inferred = pyarrow.Schema.from_pandas(dataframe, preserve_index=False)
+                    schema = pyarrow.schema([
+                        pyarrow.field(field.name, arrow_type or (pyarrow.string() if field.type == pyarrow.null()
+                                                                 else field.type))
+                        for field, arrow_type in zip(inferred, arrow_types)
+                    ])
+                    writer = pyarrow.RecordBatchStreamWriter(pyarrow.PythonFile(sink, mode="w"), schema)
+
+                writer.write_batch(pyarrow.RecordBatch.from_pandas(dataframe, schema=schema, preserve_index=False))
+                yield sink.take()
+
+            if writer is None:
+                # No rows at all, still send the schema
+                schema = pyarrow.schema([(column.name, arrow_type or pyarrow.string())
+                                         for column, arrow_type in zip(q.columns, arrow_types)])
+                writer = pyarrow.RecordBatchStreamWriter(pyarrow.PythonFile(sink, mode="w"), schema)
+
+            writer.close()
+            yield sink.take()
+
+        return generate()
+
+    def result_arrow_types(self, q: sqlalchemy.sql.expression.Select) -> list:
+        """
+        Get the Arrow types of the columns of a select from the types the database reports, without reading rows
+        :param q: Select statement on this table
+        :return: Arrow type per column, None for types without a fixed Arrow type
+        """
+        result = db.session.connection().execute(q.limit(0))
+        try:
+            return [_arrow_type(column[1]) for column in result.cursor.description]
+        finally:
+            result.close()
+
+    def iter_csv(self, compress: bool = False, sep: str = ",", header: bool = True, na_rep: str = "",
+                 chunk_size: int = 65536) -> typing.Iterator[bytes]:
+        """
+        Export the table as CSV with COPY ... TO STDOUT, passing the data on while the database produces it
+        :param compress: Gzip the output on the fly
+        :param sep: Field delimiter, a single character
+        :param header: Write the column names as the first line
+        :param na_rep: Representation of NULL values
+        :param chunk_size: Amount of bytes to collect before passing them on
+        :return: Generator of CSV (or gzip) bytes
+        """
+        if len(sep) != 1 or sep in "\r\n\"":
+            raise TableError("Invalid CSV delimiter %r" % sep)
+        if "\r" in na_rep or "\n" in na_rep:
+            raise TableError("Invalid NULL representation %r" % na_rep)
+
+        options = ["FORMAT csv", "DELIMITER %s" % _sql_literal(sep), "NULL %s" % _sql_literal(na_rep)]
+        if header:
+            options.append("HEADER")
+
+        select = self.select().compile(dialect=sqlalchemy.dialects.postgresql.dialect())
+        q = "COPY (%s) TO STDOUT WITH (%s)" % (select, ", ".join(options))
+
+        # COPY blocks until all data is written, so run it in a thread and hand over the chunks.
+        # The queue is bounded, a slow client slows down the export instead of filling memory.
+        engine = db.engine
+        chunks = queue.Queue(maxsize=16)
+        cancelled = threading.Event()
+
+        def put(item) -> None:
+            while not cancelled.is_set():
+                try:
+                    chunks.put(item, timeout=1)
+                    return
+                except queue.Full:
+                    continue
+            raise TableError("CSV export was cancelled")
+
+        class Writer(object):
+            """File object for copy_expert, collects the rows it gets one by one"""
+            def __init__(self):
+                self.buffer = []
+                self.size = 0
+
+            def write(self, data) -> None:
+                self.buffer.append(data)
+                self.size += len(data)
+                if self.size >= chunk_size:
+                    self.flush()
+
+            def flush(self) -> None:
+                if self.size > 0:
+                    put(b"".join(self.buffer))
+                self.buffer = []
+                self.size = 0
+
+        def copy() -> None:
+            connection = engine.raw_connection()
+            try:
+                writer = Writer()
+                connection.cursor().copy_expert(q, writer)
+                writer.flush()
+                put(None)
+            except TableError:
+                # Cancelled, nobody is listening anymore
+                pass
+            except Exception as e:
+                try:
+                    put(e)
+                except TableError:
+                    pass
+            finally:
+                connection.close()
+
+        def generate():
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+            thread = threading.Thread(target=copy, daemon=True)
+            thread.start()
+
+            try:
+                while True:
+                    item = chunks.get()
+                    if item is None:
+                        break
+                    elif isinstance(item, Exception):
+                        raise item
+                    yield compressor.compress(item) if compressor else item
+
+                if compressor:
+                    yield compressor.flush()
+            finally:
+                # Stop the copy if the client went away
+                cancelled.set()
+
+        return generate()
+
+    def get_data(self, compact: bool = False, chunk_size: int = 65536) -> pandas.DataFrame:
         """
         Get the data as seen by the user
+        :param compact: Load it with the memory saving types of compaction.compact_chunks, chunk by chunk,
+        so the whole table is never in memory in plain types
+        :param chunk_size: Amount of rows to read at once when loading compactly
         :return: User representation of data
         """
         if not self._has_data():
             TableError("No data to get")
 
+        if compact:
+            import compaction
+            kinds = {name: _sql_types[data_type][1] for name, data_type in self.column_types().items()
+                     if data_type in _sql_types}
+            dataframe = compaction.compact_chunks(self.iter_dataframes(chunk_size=chunk_size), kinds)
+            if dataframe is not None:
+                return dataframe
+
         return pandas.read_sql_query(self.select(), db.session.connection())
 
+    def column_types(self) -> typing.Dict[str, str]:
+        """
+        Get the database types of the columns
+        :return: Type per column name, as information_schema names it
+        """
+        q = db.text("SELECT column_name, data_type FROM information_schema.columns "
+                    "WHERE table_schema = 'tables' AND table_name = :name ;")
+        id_to_name = self.schema().id_to_name
+        result = db.session.connection().execute(q, name=self.sql_table_name())
+        return {id_to_name[int(row[0])]: row[1] for row in result if int(row[0]) in id_to_name}
+
+    def sql_column_types(self) -> typing.Dict[str, sqlalchemy.types.TypeEngine]:
+        """
+        Get the types to create the columns with again, for instance in the table of a new version
+        :return: SQL type per column name, for the types user tables can hold
+        """
+        return {name: _sql_types[data_type][0] for name, data_type in self.column_types().items()
+                if data_type in _sql_types}
+
     def get_data_raw(self) -> pandas.DataFrame:
         """
         Get the raw data as stored in the db
@@ -605,7 +1115,115 @@ class DataTable(db.Model):
         # Read it into a pandas thing
         return pandas.read_sql_query(self.select_clause(), db.session.connection())
 
-    def load_data(self, dataframe: pandas.DataFrame) -> None:
+    def sql_statistics(self, bins: int = 15) -> typing.Dict[str, dict]:
+        """
+        Compute the statistics of column_statistics in the database, the table is never read into memory.
+        One aggregate pass gives the counts, minimum, maximum, mean and deviation, a second one the
+        histograms of all numeric columns at once.
+        :param bins: Amount of equal width bins in the histograms
+        :return: Statistics per column id (as string)
+        """
+        id_to_name = self.schema().id_to_name
+        kinds = {str(self.schema().name_to_id[name]): _sql_types[data_type][1]
+                 for name, data_type in self.column_types().items() if data_type in _sql_types}
+        column_ids = [str(column_id) for column_id in id_to_name]
+        numeric = [column_id for column_id in column_ids if kinds.get(column_id) in ["integer", "float"]]
+        if len(column_ids) == 0:
+            return {}
+
+        def value(column_id: str) -> str:
+            return "CAST(\"%s\" AS double precision)" % column_id
+
+        def finite(column_id: str) -> str:
+            # NaN sorts above infinity, so this leaves it out as well
+            return "%s > '-Infinity' AND %s < 'Infinity'" % (value(column_id), value(column_id))
+
+        aggregates = ["count(*)"]
+        for column_id in column_ids:
+            aggregates += ["count(\"%s\")" % column_id, "count(DISTINCT \"%s\")" % column_id]
+        for column_id in numeric:
+            aggregates += ["%s(%s) FILTER (WHERE %s)" % (function, value(column_id), finite(column_id))
+                           for function in ["count", "min", "max", "avg", "stddev_samp"]]
+
+        q = db.text("SELECT %s FROM tables.\"%s\" ;" % (", ".join(aggregates), self.sql_table_name()))
+        row = list(db.session.connection().execute(q).first())
+
+        count = int(row.pop(0))
+        statistics = dict()
+        for column_id in column_ids:
+            values, distinct = int(row.pop(0)), int(row.pop(0))
+            statistics[column_id] = {"count": count, "nulls": count - values, "distinct": distinct}
+
+        ranges = dict()
+        for column_id in numeric:
+            finite_count, minimum, maximum, mean, std = row[:5]
+            del row[:5]
+            if finite_count:
+                statistics[column_id].update({
+                    "min": float(minimum),
+                    "max": float(maximum),
+                    "mean": float(mean),
+                    "std": float(std) if std is not None else None,
+                })
+                ranges[column_id] = (int(finite_count), float(minimum), float(maximum))
+
+        # Bins like numpy.histogram, the maximum goes in the last one
+        histograms = dict()
+        buckets = dict()
+        for column_id, (finite_count, minimum, maximum) in ranges.items():
+            if minimum == maximum:
+                # Numpy puts a single value in the middle bin of a range of one around it
+                counts, edges = numpy.histogram([minimum], bins=bins)
+                histograms[column_id] = (counts * finite_count, edges)
+            else:
+                histograms[column_id] = (numpy.zeros(bins, dtype=numpy.int64),
+                                         numpy.linspace(minimum, maximum, bins + 1))
+                buckets[column_id] = "CASE WHEN %s THEN least(width_bucket(%s, CAST(:min_%s AS double precision), " \
+                                     "CAST(:max_%s AS double precision), %s), %s) END" % (
+                                         finite(column_id), value(column_id), column_id, column_id, bins, bins)
+
+        if buckets:
+            # One pass for all histograms, every grouping set counts the buckets of one column
+            names = list(buckets)
+            q = db.text("SELECT %s, count(*) FROM tables.\"%s\" GROUP BY GROUPING SETS (%s) ;" % (
+                ", ".join("%s AS \"b_%s\"" % (buckets[column_id], column_id) for column_id in names),
+                self.sql_table_name(), ", ".join("(\"b_%s\")" % column_id for column_id in names)))
+            parameters = dict()
+            for column_id in names:
+                parameters["min_%s" % column_id] = ranges[column_id][1]
+                parameters["max_%s" % column_id] = ranges[column_id][2]
+
+            for result_row in db.session.connection().execute(q, **parameters):
+                for column_id, bucket in zip(names, result_row[:-1]):
+                    if bucket is not None:
+                        histograms[column_id][0][int(bucket) - 1] += int(result_row[-1])
+
+        for column_id, (counts, edges) in histograms.items():
+            statistics[column_id]["histogram"] = {"counts": [int(x) for x in counts],
+                                                  "edges": [float(x) for x in edges]}
+
+        return statistics
+
+    def update_statistics(self, dataframe: pandas.DataFrame = None) -> None:
+        """
+        Compute the statistics of all columns, does not commit
+        :param dataframe: Raw data of the table when it is in memory already, otherwise the statistics
+        are computed in the database with sql_statistics
+        """
+        from .data_column import column_statistics
+
+        if dataframe is None:
+            statistics = self.sql_statistics()
+        else:
+            statistics = {column_id: column_statistics(dataframe[column_id]) for column_id in dataframe}
+
+        for column in self.columns.all():
+            if str(column.id) in statistics:
+                column.statistics = statistics[str(column.id)]
+                db.session.add(column)
+
+    def load_data(self, dataframe: pandas.DataFrame, chunk_size: int = 65536) -> None:
+        import compaction
         from .data_column import DataColumn
 
         for col in self.columns.all():
@@ -617,8 +1235,63 @@ class DataTable(db.Model):
             new_column = DataColumn(self, col)
             dataframe.rename(columns={col: str(new_column.id)}, inplace=True)
 
-        dataframe.to_sql(self.sql_table_name(), db.session.connection(), schema="tables", if_exists="replace",
-                         index=False)
+        # Replacing the table drops its indexes as well
+        column_index.forget(self.id)
+        self.forget_schema()
+
+        # The types come from the whole dataframe, the rows go out in slices so only one slice at a time
+        # is expanded from compacted types. Integers with missing values stay integers.
+        sql_types = {col: _sql_type(dataframe[col]) for col in dataframe}
+        for start in range(0, max(1, len(dataframe)), chunk_size):
+            rows = compaction.expand(dataframe.iloc[start:start + chunk_size].copy(), nullable=True)
+            rows.to_sql(self.sql_table_name(), db.session.connection(), schema="tables",
+                        if_exists="replace" if start == 0 else "append", index=False, dtype=sql_types)
+        self.update_statistics(dataframe)
+
+        self.loaded = True
+        self._bump_revision()
+        self._update_db()
+
+    def load_chunks(self, chunks: typing.Iterable[pandas.DataFrame],
+                    column_types: typing.Dict[str, sqlalchemy.types.TypeEngine] = None) -> None:
+        """
+        Load data that does not have to fit in memory, one chunk at a time. The columns come from
+        the first chunk, the statistics are computed in the database once all chunks are written.
+        :param chunks: Dataframes with the same columns, at least one
+        :param column_types: SQL types of the columns by name. The others get the type of their values
+        in the first chunk, which is a guess when they are all null there.
+        """
+        column_types = column_types or {}
+        from .data_column import DataColumn
+
+        for col in self.columns.all():
+            self.columns.remove(col)
+        self._update_db()
 
+        # Replacing the table drops its indexes as well
+        column_index.forget(self.id)
+        self.forget_schema()
+
+        names = None
+        sql_types = None
+        for dataframe in chunks:
+            if_exists = "append"
+            if names is None:
+                # Create the columns from the first chunk, it replaces whatever table was there
+                names = {col: str(DataColumn(self, col).id) for col in dataframe}
+                sql_types = {names[col]: column_types[col] if col in column_types else _sql_type(dataframe[col])
+                             for col in dataframe}
+                if_exists = "replace"
+
+            dataframe.rename(columns=names, inplace=True)
+            dataframe.to_sql(self.sql_table_name(), db.session.connection(), schema="tables", if_exists=if_exists,
+                             index=False, dtype=sql_types)
+
+        if names is None:
+            raise TableError("No data to load")
+
+        self.forget_schema()
+        self.update_statistics()
         self.loaded = True
+        self._bump_revision()
         self._update_db()
@@ -299,7 +299,9 @@ class DataVersion(db.Model):
         tables = [DataTable.query.get(x) for x in table_ids]
         columns = []
         for table in tables:
-            columns.extend([column.sql_column_clause().label(table.name+"."+column.name) for column in table.columns.all()])
+            schema = table.schema()
+            columns.extend([db.column(str(column_id)).label(table.name + "." + name)
+                            for column_id, name in zip(schema.column_ids, schema.column_names)])
 
         select: sqlalchemy.sql.expression.Select = \
             sqlalchemy.sql.expression.select(columns).select_from(join_clause)
@@ -9,6 +9,9 @@ table_names = {
     "DataTable": "table",
     "DataColumn": "column",
 
+    "DedupJob": "dedup_job",
+    "DedupCluster": "dedup_cluster",
+
     "User": "user",
     "Role": "role"
 }
@@ -0,0 +1,224 @@
+import collections
+import datetime
+import threading
+import typing
+
+import flask
+
+from . import similarity_index
+from .db_object import db, table_names
+
+if typing.TYPE_CHECKING:
+    from .data_column import DataColumn
+
+
+class DedupJob(db.Model):
+    """Deduplication run on a column, the candidate clusters it found are kept as DedupCluster rows"""
+    # Save everything in the dedup_job table
+    __tablename__ = table_names["DedupJob"]
+
+    # Status of a job, it only moves forward
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    # Needed for normal operation
+    # ----------------------------------------------------------------
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Table and column the job looks at, the job goes together with them
+    table_id = db.Column(db.Integer, db.ForeignKey(table_names["DataTable"] + ".id", ondelete="CASCADE"),
+                         nullable=False)
+    column_id = db.Column(db.Integer, db.ForeignKey(table_names["DataColumn"] + ".id", ondelete="CASCADE"),
+                          nullable=False)
+
+    # Info about children
+    # --------------------------------------------
+    clusters = db.relationship("DedupCluster", backref="job", lazy="dynamic", cascade="all,delete-orphan",
+                               passive_deletes=True)
+
+    # Metadata
+    # --------------------------------------------
+    # Name of the column when the job was started
+    column_name = db.Column(db.String, nullable=False)
+    # How duplicates are found, "levenshtein" or one of the key methods in transform.KEY_METHODS
+    method = db.Column(db.String, nullable=False, default="levenshtein")
+    # Maximum edit distance between duplicates, only used by levenshtein
+    threshold = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String, nullable=False, default=PENDING)
+    # What went wrong, for failed jobs
+    error = db.Column(db.String, nullable=True, default=None)
+    # Amount of clusters found
+    cluster_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True, default=None)
+    # Last sign of life of the thread running the job, a job that stops giving them died with its process
+    heartbeat_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+    def __init__(self, column: "DataColumn", threshold: int, method: str = "levenshtein", *args, **kwargs):
+        """"""
+        super(DedupJob, self).__init__(*args, **kwargs)
+
+        self.table_id = column.table_id
+        self.column_id = column.id
+        self.column_name = column.name
+        self.threshold = threshold
+        self.method = method
+        self.status = DedupJob.PENDING
+        self._update_db()
+
+    def _update_db(self) -> None:
+        db.session.add(self)
+        db.session.commit()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DedupJob.DONE, DedupJob.FAILED)
+
+    def fail_if_stale(self, interval: int) -> None:
+        """
+        Mark the job as failed when the thread running it stopped giving signs of life
+        :param interval: Seconds between heartbeats, see DEDUP_HEARTBEAT
+        """
+        if not self.finished and self.heartbeat_at < _stale_before(interval):
+            self.status = DedupJob.FAILED
+            self.error = INTERRUPTED
+            self.finished_at = datetime.datetime.utcnow()
+            self._update_db()
+
+    def start(self) -> None:
+        """
+        Run the job in the background, the request that started it does not wait for it
+        """
+        app = flask.current_app._get_current_object()
+        thread = threading.Thread(target=_run_job, args=(app, self.id), daemon=True)
+        thread.start()
+
+    def neighbours(self, limit: int = None) -> typing.Dict[str, typing.List[str]]:
+        """
+        Get the found clusters in the format of transform.find_duplicates, biggest clusters first
+        :param limit: Maximum amount of clusters
+        :return: Ordered dict from string to its possible duplicates, most probable first
+        """
+        query = self.clusters.order_by(DedupCluster.size.desc(), DedupCluster.id)
+        if limit is not None:
+            query = query.limit(limit)
+
+        return collections.OrderedDict((cluster.value, cluster.neighbours) for cluster in query)
+
+
+class DedupCluster(db.Model):
+    """A string found by a DedupJob, together with its possible duplicates"""
+    # Save everything in the dedup_cluster table
+    __tablename__ = table_names["DedupCluster"]
+    # Clusters are paged through by size
+    __table_args__ = (db.Index("ix_dedup_cluster_job_size", "job_id", "size", "id"),)
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.Integer, db.ForeignKey(table_names["DedupJob"] + ".id", ondelete="CASCADE"),
+                       nullable=False)
+
+    # The string itself
+    value = db.Column(db.String, nullable=False)
+    # Amount of strings in the cluster, the string itself included
+    size = db.Column(db.Integer, nullable=False)
+    # Strings in the cluster, most probable replacement first
+    neighbours = db.Column(db.JSON, nullable=False)
+
+
+# Error of jobs whose process stopped before they finished
+INTERRUPTED = "Interrupted, the process running the job stopped"
+# Heartbeats a job may miss before it counts as dead
+_MISSED_HEARTBEATS = 4
+
+
+def _stale_before(interval: int) -> datetime.datetime:
+    return datetime.datetime.utcnow() - datetime.timedelta(seconds=_MISSED_HEARTBEATS * interval)
+
+
+def fail_stale_jobs(interval: int) -> int:
+    """
+    Mark every unfinished job whose thread stopped giving signs of life as failed, for jobs that were
+    running in a process that was stopped or crashed. Jobs of other processes that are alive stay as they are.
+    :param interval: Seconds between heartbeats, see DEDUP_HEARTBEAT
+    :return: Amount of jobs marked as failed
+    """
+    count = DedupJob.query \
+        .filter(DedupJob.status.in_([DedupJob.PENDING, DedupJob.RUNNING]),
+                DedupJob.heartbeat_at < _stale_before(interval)) \
+        .update({"status": DedupJob.FAILED, "error": INTERRUPTED, "finished_at": datetime.datetime.utcnow()},
+                synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+def _heartbeat(app: flask.Flask, job_id: int, stop: threading.Event, interval: int) -> None:
+    """
+    Keep the heartbeat of a job up to date until it is stopped. Runs in its own thread, next to the job.
+    """
+    with app.app_context():
+        try:
+            while not stop.wait(interval):
+                DedupJob.query.filter_by(id=job_id).update({"heartbeat_at": datetime.datetime.utcnow()},
+                                                           synchronize_session=False)
+                db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def _run_job(app: flask.Flask, job_id: int) -> None:
+    """
+    Find the duplicates for a job and store them as clusters. Runs in a background thread.
+    """
+    import transform
+    from .data_column import DataColumn
+
+    with app.app_context():
+        try:
+            job: DedupJob = DedupJob.query.get(job_id)
+            if job is None:
+                # Removed together with its table before it got to run
+                return
+            job.status = DedupJob.RUNNING
+            job.heartbeat_at = datetime.datetime.utcnow()
+            db.session.commit()
+
+            stop = threading.Event()
+            threading.Thread(target=_heartbeat, args=(app, job_id, stop, app.config.get("DEDUP_HEARTBEAT", 30)),
+                             daemon=True).start()
+
+            try:
+                column: DataColumn = DataColumn.query.get(job.column_id)
+                if job.method == "levenshtein":
+                    # Start from the graph of the last run on this column, in any version
+                    path = similarity_index.index_path(column, job.threshold)
+                    with similarity_index.lock(path):
+                        graph = similarity_index.load(path) or transform.SimilarityGraph(job.threshold)
+                        neighbours = transform.find_duplicates(column.get_data(), column.name, job.threshold,
+                                                               workers=app.config.get("DEDUP_WORKERS", 1),
+                                                               graph=graph)
+                        similarity_index.store(path, graph)
+                else:
+                    neighbours = transform.find_key_collisions(column.get_data(), column.name, job.method)
+
+                clusters = [{"job_id": job.id, "value": value, "size": len(strings), "neighbours": strings}
+                            for value, strings in neighbours.items()]
+                # Insert in batches, there can be a lot of them
+                for start in range(0, len(clusters), 10000):
+                    db.session.bulk_insert_mappings(DedupCluster, clusters[start:start + 10000])
+
+                job.cluster_count = len(clusters)
+                job.status = DedupJob.DONE
+            except Exception as e:
+                # Whatever went wrong, the job has to end up finished
+                db.session.rollback()
+                job = DedupJob.query.get(job_id)
+                job.status = DedupJob.FAILED
+                job.error = str(e)
+            finally:
+                stop.set()
+
+            job.finished_at = datetime.datetime.utcnow()
+            db.session.commit()
+        finally:
+            db.session.remove()
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import threading
+import typing
+import uuid
+
+import flask
+
+if typing.TYPE_CHECKING:
+    from .data_table import DataTable
+
+
+# Only one thread at a time evicts files
+_evict_lock: threading.Lock = threading.Lock()
+
+
+def export_key(table: "DataTable", export_format: str, **options) -> str:
+    """
+    Get the key of an export, it doubles as the (strong) ETag of the exported file
+    :param table: Table that is exported
+    :param export_format: Format of the export, like csv or arrow
+    :param options: Options that change the exported bytes
+    :return: Hex digest identifying the export
+    """
+    key = "%s;%s;%s;%s" % (table.id, table.revision or 0, export_format,
+                           ";".join("%s=%s" % (name, options[name]) for name in sorted(options)))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _folder() -> str:
+    return flask.current_app.config.get("EXPORT_CACHE_FOLDER", "local/exports/")
+
+
+def cached_path(key: str) -> typing.Optional[str]:
+    """
+    Get the file of a cached export and mark it as recently used
+    :param key: Key of the export
+    :return: Path to the file or None if it is not cached
+    """
+    path = os.path.join(_folder(), key)
+
+    try:
+        # Touch the file, eviction goes by modification time
+        os.utime(path)
+    except OSError:
+        return None
+
+    return path
+
+
+def store(key: str, chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+    """
+    Pass on the chunks of an export while writing them to the cache.
+    The file only enters the cache when all chunks went through.
+    :param key: Key of the export
+    :param chunks: Chunks of the export
+    :return: Generator of the same chunks
+    """
+    folder = _folder()
+    budget = flask.current_app.config.get("EXPORT_CACHE_SIZE", 0)
+    os.makedirs(folder, 0o755, exist_ok=True)
+
+    path = os.path.join(folder, key)
+    temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+
+    complete = False
+    try:
+        with open(temp_path, "wb") as file:
+            for chunk in chunks:
+                file.write(chunk)
+                yield chunk
+        os.replace(temp_path, path)
+        complete = True
+    finally:
+        if not complete and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    evict(folder, budget)
+
+
+def evict(folder: str, budget: int) -> None:
+    """
+    Remove the least recently used exports until the cache fits in its budget
+    :param folder: Folder of the cache
+    :param budget: Maximum size of the cache in bytes
+    """
+    with _evict_lock:
+        files = []
+        for entry in os.scandir(folder):
+            # Skip exports that are still being written
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Somebody else removed it already
+                pass
+            total -= size
@@ -2,6 +2,7 @@ import flask_security
 import sqlalchemy
 
 from .db_object import db, table_names
+from .user import clear_role_caches
 
 
 def delete_role(role_id: int) -> bool:
@@ -15,6 +16,7 @@ def delete_role(role_id: int) -> bool:
     if role:
         db.session.delete(role)
         db.session.commit()
+        clear_role_caches()
         return True
     else:
         return False
@@ -53,6 +55,8 @@ class Role(db.Model, flask_security.RoleMixin):
         if name:
             self.name = name
             self._update_db()
+            # Users cache the names of their roles
+            clear_role_caches()
 
         return self.name
 
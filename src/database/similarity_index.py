@@ -0,0 +1,150 @@
+import glob
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+import typing
+import uuid
+
+import flask
+
+if typing.TYPE_CHECKING:
+    from transform import SimilarityGraph
+    from .data import Data
+    from .data_column import DataColumn
+
+
+# Jobs on the same column in one process update its graph one at a time
+_locks: typing.Dict[str, threading.Lock] = dict()
+_locks_lock: threading.Lock = threading.Lock()
+# Only one thread at a time evicts graphs
+_evict_lock: threading.Lock = threading.Lock()
+
+
+def _folder(data: "Data") -> str:
+    return os.path.join(data.dir_name(), "similarity")
+
+
+def _column_key(table_name: str, column_name: str) -> str:
+    return hashlib.sha1(("%s;%s" % (table_name, column_name)).encode("utf-8")).hexdigest()
+
+
+def index_path(column: "DataColumn", threshold: int) -> str:
+    """
+    Get the file of the similarity graph of a column. Every version of the data shares it,
+    columns are told apart by table and column name.
+    :param column: Column the graph is for
+    :param threshold: Maximum edit distance of the graph
+    :return: Path to the file
+    """
+    data = column.table.version.data
+    return os.path.join(_folder(data), "%s-%s" % (_column_key(column.table.name, column.name), threshold))
+
+
+def lock(path: str) -> threading.Lock:
+    """
+    Get the lock for a graph, hold it from loading the graph until it is stored again
+    :param path: Path to the graph
+    :return: Lock
+    """
+    with _locks_lock:
+        return _locks.setdefault(path, threading.Lock())
+
+
+def load(path: str) -> typing.Optional["SimilarityGraph"]:
+    """
+    Load a stored similarity graph
+    :param path: Path to the graph
+    :return: The graph or None when there is none or it cannot be read
+    """
+    try:
+        with open(path, "rb") as file:
+            graph = pickle.load(file)
+        # Touch the file, eviction goes by modification time
+        os.utime(path)
+        return graph
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        # Never stored, evicted or from an older layout, it is simply built again
+        return None
+
+
+def store(path: str, graph: "SimilarityGraph") -> None:
+    """
+    Store a similarity graph, readers see either the old or the new file
+    :param path: Path to the graph
+    :param graph: Graph to store
+    """
+    os.makedirs(os.path.dirname(path), 0o755, exist_ok=True)
+    temp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+
+    try:
+        with open(temp_path, "wb") as file:
+            pickle.dump(graph, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    # The graphs of all data count against one budget, the data folders are next to each other
+    root = os.path.dirname(os.path.dirname(os.path.dirname(path)))
+    evict(glob.glob(os.path.join(root, "*", "similarity")),
+          flask.current_app.config.get("SIMILARITY_INDEX_SIZE", 0))
+
+
+def evict(folders: typing.Iterable[str], budget: int) -> None:
+    """
+    Remove the least recently used graphs until they fit in their budget together
+    :param folders: Folders with graphs
+    :param budget: Maximum size of all graphs in bytes
+    """
+    with _evict_lock:
+        files = []
+        for folder in folders:
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                # Removed together with its data
+                continue
+            for entry in entries:
+                # Skip graphs that are still being written
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(f[1] for f in files)
+        for _, size, path in sorted(files):
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Somebody else removed it already
+                pass
+            total -= size
+
+
+def remove_unused(data: "Data") -> None:
+    """
+    Remove the graphs of columns that no version of the data has anymore, after a version was removed
+    :param data: Data to clean up
+    """
+    used = {_column_key(table.name, column.name)
+            for version in data.versions for table in version.tables for column in table.columns}
+
+    for path in glob.glob(os.path.join(_folder(data), "*")):
+        if path.endswith(".tmp"):
+            continue
+        if os.path.basename(path).partition("-")[0] not in used:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def remove_all(data: "Data") -> None:
+    """
+    Remove all graphs of the data, when the data itself is removed
+    :param data: Data to clean up
+    """
+    shutil.rmtree(_folder(data), ignore_errors=True)
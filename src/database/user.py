@@ -8,6 +8,15 @@ if typing.TYPE_CHECKING:
     from .role import Role
 
 
+def clear_role_caches() -> None:
+    """
+    Forget the cached roles of all users loaded in the current session
+    """
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, User):
+            obj.clear_role_cache()
+
+
 def delete_user(user_id: int) -> bool:
     """
     Delete the user with the given id
@@ -87,6 +96,37 @@ class User(db.Model, flask_security.UserMixin):
         db.session.add(self)
         db.session.commit()
 
+    def _role_cache(self) -> typing.Tuple[typing.FrozenSet[int], typing.FrozenSet[str]]:
+        """
+        Get the ids and names of the roles of this user, they are only queried once
+        :return: Set of role ids and set of role names
+        """
+        from .role import Role
+
+        cache = getattr(self, "_roles", None)
+        if cache is None:
+            # Load the roles once, every later check is a set lookup
+            rows = db.session.query(Role.id, Role.name) \
+                .join(user_roles, user_roles.c.role_id == Role.id) \
+                .filter(user_roles.c.user_id == self.id).all()
+            cache = (frozenset(row[0] for row in rows), frozenset(row[1] for row in rows))
+            self._roles = cache
+
+        return cache
+
+    def clear_role_cache(self) -> None:
+        """
+        Forget the cached roles, the next check queries them again
+        """
+        self._roles = None
+
+    def role_ids(self) -> typing.FrozenSet[int]:
+        """
+        Get the ids of all roles of this user
+        :return: Set of role ids
+        """
+        return self._role_cache()[0]
+
     def has_role(self, role: "Role") -> bool:
         """
         return 'True' if the user has the
@@ -96,11 +136,11 @@ class User(db.Model, flask_security.UserMixin):
         from .role import Role
 
         if isinstance(role, Role):
-            return self.roles.filter(Role.id == role.id).count() > 0
+            return role.id in self._role_cache()[0]
         elif isinstance(role, int):
-            return self.roles.filter(Role.id == role).count() > 0
+            return role in self._role_cache()[0]
         elif isinstance(role, str):
-            return self.roles.filter(Role.name == role).count() > 0
+            return role in self._role_cache()[1]
         else:
             return False
 
@@ -112,6 +152,7 @@ class User(db.Model, flask_security.UserMixin):
         if not self.has_role(role):
             self.roles.append(role)
             self._update_db()
+            self.clear_role_cache()
 
     def activate(self) -> None:
         self.active = True
@@ -127,9 +168,8 @@ class User(db.Model, flask_security.UserMixin):
         :return: query for databases with access rights
         """
         from .data import Data
-        from .role import Role
 
-        return Data.query.join(Data.access_role).filter(Role.id.in_(r.id for r in self.roles.all()))
+        return Data.query.filter(Data.access_role_id.in_(self.role_ids()))
 
     def database_admin_query(self):
         """
@@ -137,6 +177,5 @@ class User(db.Model, flask_security.UserMixin):
         :return: query for databases with access rights
         """
         from .data import Data
-        from .role import Role
 
-        return Data.query.join(Data.admin_role).filter(Role.id.in_(r.id for r in self.roles.all()))
+        return Data.query.filter(Data.admin_role_id.in_(self.role_ids()))
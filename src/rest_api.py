@@ -1,3 +1,9 @@
+import collections
+import datetime
+import decimal
+import hashlib
+import json
+import threading
 import flask
 import flask_restful
 import flask_security
@@ -5,9 +11,13 @@ import sqlalchemy.orm.query
 import pandas
 import werkzeug.datastructures
 
-from database import db, Data, DataVersion, DataTable, DataColumn, Role, User, TableError
+from database import db, Data, DataVersion, DataTable, DataColumn, DedupJob, DedupCluster, Role, User, TableError
+from database import column_index
 from database.data import delete_data
+from database.data_version import delete_version
+from database.raw_tables import user_roles
 import transform
+import sketch
 
 
 def _get_from_request(prop: str, request: flask.Request = flask.request):
@@ -33,7 +43,7 @@ def _is_admin(user: User) -> bool:
     :param user: User object
     :return: is admin?
     """
-    return user.has_role(Role.query.get(0))
+    return user.has_role(0)
 
 
 def _none_status(obj, user: User = flask_security.current_user, fault_status: int = 400) -> None:
@@ -79,6 +89,234 @@ def _float(value, user: User = flask_security.current_user):
     return value
 
 
+def _json_default(obj):
+    """
+    Convert values coming straight from the database driver to something JSON can handle
+    :param obj: Value that json could not encode
+    :return: Encodable value
+    """
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    elif isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    elif isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    elif isinstance(obj, (bytes, memoryview)):
+        return bytes(obj).hex()
+    return str(obj)
+
+
+def _stream_json(head: dict, key: str, chunks) -> flask.Response:
+    """
+    Stream a JSON object with one (big) list in it, encoding the list chunk by chunk
+    :param head: All other keys of the object
+    :param key: Key of the list
+    :param chunks: Iterable of lists of list items
+    :return: Chunked response
+    """
+    def generate():
+        # Open the object and the list, the rest of the object goes first
+        prefix = json.dumps(head, default=_json_default)[:-1]
+        yield prefix + (", " if len(head) > 0 else "") + json.dumps(key) + ": ["
+
+        first = True
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            # Encode the whole chunk at once, then strip the brackets
+            yield ("" if first else ",") + json.dumps(chunk, default=_json_default)[1:-1]
+            first = False
+
+        yield "]}"
+
+    return flask.Response(flask.stream_with_context(generate()), mimetype="application/json")
+
+
+class _ResponseCache(object):
+    """Thread-safe LRU cache of response bodies, bounded by their total size"""
+
+    def __init__(self):
+        self.entries: collections.OrderedDict = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        """
+        Get a cached (body, mimetype) pair
+        :param key: Key of the response
+        :return: Cached pair or None
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, body: bytes, mimetype: str, max_size: int) -> None:
+        """
+        Cache a response body, dropping the least recently used ones to stay within max_size
+        :param key: Key of the response
+        :param body: Body of the response
+        :param mimetype: Mimetype of the response
+        :param max_size: Maximum total size of all cached bodies
+        """
+        if len(body) > max_size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = (body, mimetype)
+            self.size += len(body)
+            while self.size > max_size:
+                _, (old_body, _) = self.entries.popitem(last=False)
+                self.size -= len(old_body)
+
+
+_response_cache = _ResponseCache()
+
+
+def _etag(*parts) -> str:
+    """
+    Make an ETag out of the things a response depends on
+    :param parts: Ids, revisions, arguments, ...
+    :return: ETag value
+    """
+    return hashlib.sha1(";".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def _version_etag(resource: str, version: DataVersion) -> str:
+    """
+    Get the ETag of a resource describing a version, it only changes when its tables do
+    :param resource: Name of the resource
+    :param version: Version the resource describes
+    :return: ETag value
+    """
+    tables = db.session.query(DataTable.id, DataTable.revision) \
+        .filter(DataTable.version_id == version.id).order_by(DataTable.id).all()
+    return _etag(resource, version.id, *("%s.%s" % (table_id, revision) for table_id, revision in tables))
+
+
+def _cached_response(etag: str, build) -> flask.Response:
+    """
+    Answer a GET request for an immutable resource: 304 if the client has it, from the response cache if
+    we have it, or build it otherwise. Authorization has to be checked before calling this.
+    :param etag: ETag of the resource
+    :param build: Function that builds the full response
+    :return: Response with ETag and Cache-Control headers
+    """
+    config = flask.current_app.config
+
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        cached = _response_cache.get(etag)
+        if cached is None:
+            response = build()
+            # Streamed responses stay streamed, they are too big to keep around anyway
+            if response.status_code == 200 and not response.is_streamed:
+                _response_cache.put(etag, response.get_data(), response.mimetype,
+                                    config.get("RESPONSE_CACHE_SIZE", 0))
+        else:
+            response = flask.Response(cached[0], mimetype=cached[1])
+
+    response.set_etag(etag)
+    # Only the authorized user may keep it, and has to check back when it gets stale
+    response.cache_control.private = True
+    response.cache_control.max_age = config.get("HTTP_CACHE_MAX_AGE", 0)
+    response.cache_control.must_revalidate = True
+    return response
+
+
+def _estimate_count(query: sqlalchemy.orm.query.Query) -> int:
+    """
+    Get the planner estimate of the amount of rows a query returns, without running it
+    :param query: Query to estimate
+    :return: Estimated amount of rows
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+
+    # Go through the DBAPI cursor, so the bound parameters are passed the way the dialect compiled them
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute("EXPLAIN (FORMAT JSON) %s" % compiled, compiled.params)
+        plan = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _filter_contains(query: sqlalchemy.orm.query.Query, column, arg: str) -> sqlalchemy.orm.query.Query:
+    """
+    Filter a query on a column containing the value of a query string argument, case insensitive
+    :param query: Query to filter
+    :param column: Column to filter on
+    :param arg: Name of the query string argument
+    :return: Filtered query
+    """
+    value = flask.request.args.get(arg)
+    if not value:
+        return query
+
+    value = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return query.filter(column.ilike("%" + value + "%"))
+
+
+def _bool(value) -> bool:
+    """
+    Read a flag from a request, "0", "false", "off", "no" and empty strings are off like a missing flag
+    :param value: Query string or json value
+    :return: Whether the flag is on
+    """
+    if isinstance(value, str):
+        return value.strip().lower() not in ["0", "false", "off", "no", ""]
+    return bool(value)
+
+
+def _filter_bool(query: sqlalchemy.orm.query.Query, column, arg: str) -> sqlalchemy.orm.query.Query:
+    """
+    Filter a query on a boolean column equal to a query string argument
+    :param query: Query to filter
+    :param column: Column to filter on
+    :param arg: Name of the query string argument
+    :return: Filtered query
+    """
+    value = flask.request.args.get(arg)
+    if value is None:
+        return query
+
+    return query.filter(column == _bool(value))
+
+
+def _dict_page(query: sqlalchemy.orm.query.Query, id_column, depth: int = 0, extra: bool = False) -> dict:
+    """
+    Convert one page of a query to a dict of objects, using keyset pagination on the id.
+    ?cursor=<next_cursor of the previous page>&limit=<page size, at most 1000>
+    :param query: Query to list, filters included
+    :param id_column: Unique column to page on
+    :param depth: Depth to query objects at
+    :param extra: Include extra info?
+    :return: Dict with data, size, next_cursor and total_estimate
+    """
+    limit = min(max(_int(flask.request.args.get("limit", 100)), 1), 1000)
+    cursor = flask.request.args.get("cursor")
+
+    total = _estimate_count(query)
+
+    if cursor is not None:
+        query = query.filter(id_column > _int(cursor))
+
+    # Ask for one more, to know if there is a next page
+    objects = query.order_by(id_column).limit(limit + 1).all()
+    next_cursor = str(objects[limit - 1].id) if len(objects) > limit else None
+
+    result = _dict_list(_dict_objects(objects[:limit], depth, extra))
+    result["next_cursor"] = next_cursor
+    result["total_estimate"] = total
+    return result
+
+
 def _dict_query(query: sqlalchemy.orm.query.Query, depth: int = 0, extra: bool = False) -> dict:
     """
     Convert a query to a dict of objects
@@ -87,25 +325,298 @@ def _dict_query(query: sqlalchemy.orm.query.Query, depth: int = 0, extra: bool =
     :param extra: Include extra info?
     :return: Dict with data and size
     """
+    return _dict_list(_dict_objects(query.all(), depth, extra))
+
+
+def _dict_list(items: list) -> dict:
+    """
+    Wrap a list of dict representations
+    :param items: List of dicts
+    :return: Dict with data and size
+    """
+    return {"data": items, "size": len(items)}
+
+
+def _dict_objects(objects: list, depth: int = 0, extra: bool = False) -> list:
+    """
+    Convert a list of objects to their dict representations.
+    Objects of the same type are converted in one batch, so every level of relationships
+    costs a fixed amount of queries, no matter how many objects there are.
+    :param objects: Objects to convert
+    :param depth: Depth to convert at
+    :param extra: Include extra info?
+    :return: List of dicts, in the same order as the objects
+    """
+    result = [None] * len(objects)
+
+    by_type = collections.OrderedDict()
+    for i, obj in enumerate(objects):
+        by_type.setdefault(type(obj), []).append(i)
+
+    for obj_type, indices in by_type.items():
+        if obj_type not in _dict_batch_functions:
+            raise TypeError("Unsupported type: %s" % str(obj_type))
+
+        dicts = _dict_batch_functions[obj_type]([objects[i] for i in indices], depth, extra)
+        for i, d in zip(indices, dicts):
+            result[i] = d
+
+    return result
+
+
+def _dict_children(pairs: list, depth: int = 0, extra: bool = False) -> dict:
+    """
+    Convert the children of a batch of objects and group them per parent
+    :param pairs: List of (parent key, child object) pairs, in the order the children should appear
+    :param depth: Depth to convert the children at
+    :param extra: Include extra info?
+    :return: Dict of parent key -> list of child dicts
+    """
+    # Convert every child once, even if it has multiple parents
+    unique = collections.OrderedDict()
+    for _, child in pairs:
+        unique.setdefault(child.id, child)
+    dicts = dict(zip(unique.keys(), _dict_objects(list(unique.values()), depth, extra)))
+
+    grouped = collections.defaultdict(list)
+    for parent_key, child in pairs:
+        grouped[parent_key].append(dicts[child.id])
+    return grouped
+
+
+def _role_users(role_ids: set) -> list:
+    """
+    Get the users of a set of roles in one query
+    :param role_ids: IDs of the roles
+    :return: List of (role id, User) pairs
+    """
+    if len(role_ids) == 0:
+        return []
+
+    return db.session.query(user_roles.c.role_id, User).select_from(user_roles) \
+        .join(User, User.id == user_roles.c.user_id) \
+        .filter(user_roles.c.role_id.in_(role_ids)).order_by(User.id).all()
+
+
+def _dict_columns(columns: list, depth: int = 0, extra: bool = False) -> list:
+    """
+    Convert columns to dicts
+    :param columns: Column objects to convert
+    :param depth: Depth to convert at
+    :param extra: Extra info
+    :return: Dict representations of the DataColumns
+    """
     result = []
 
-    for obj in query.all():
-        if type(obj) is Data:
-            result.append(_dict_data(obj, depth, extra))
-        elif type(obj) is DataVersion:
-            result.append(_dict_version(obj, depth, extra))
-        elif type(obj) is DataTable:
-            result.append(_dict_table(obj, depth, extra))
-        elif type(obj) is DataColumn:
-            result.append(_dict_column(obj, depth, extra))
-        elif type(obj) is User:
-            result.append(_dict_user(obj, depth, extra))
-        elif type(obj) is Role:
-            result.append(_dict_role(obj, depth, extra))
-        else:
-            raise TypeError("Unsupported type: %s" % str(type(obj)))
+    for column in columns:
+        data = {
+            "id": column.id,
+            "name": column.name
+        }
 
-    return {"data": result, "size": len(result)}
+        if extra:
+            data["table_id"] = column.table_id
+
+        result.append(data)
+
+    return result
+
+
+def _dict_datas(datas: list, depth: int = 0, extra: bool = False) -> list:
+    """
+    Convert Data objects to their dict representations
+    :param datas: Data objects
+    :param depth: Depth to convert at
+    :param extra: Extra information
+    :return: Dict versions of the Data objects
+    """
+    # Both roles of every Data in one go
+    role_ids = {data.access_role_id for data in datas} | {data.admin_role_id for data in datas}
+    roles = Role.query.filter(Role.id.in_(role_ids)).all() if len(role_ids) > 0 else []
+    role_dicts = dict(zip([role.id for role in roles], _dict_roles(roles, max(depth - 1, 0))))
+
+    if depth > 0:
+        data_ids = [data.id for data in datas]
+        versions = _dict_children(
+            [(version.data_id, version) for version in
+             DataVersion.query.filter(DataVersion.data_id.in_(data_ids)).order_by(DataVersion.version)],
+            max(depth - 1, 0)
+        )
+        users = _dict_children(_role_users({data.access_role_id for data in datas}), max(depth - 1, 0))
+
+    result = []
+
+    for data in datas:
+        d = {
+            "id": data.id,
+            "name": data.name,
+            "description": data.description,
+            "access_role": role_dicts[data.access_role_id],
+            "admin_role": role_dicts[data.admin_role_id]
+        }
+
+        if depth > 0:
+            d["versions"] = _dict_list(versions[data.id])
+            d["users"] = _dict_list(users[data.access_role_id])
+
+        result.append(d)
+
+    return result
+
+
+def _dict_roles(roles: list, depth: int = 0, extra: bool = False) -> list:
+    """
+    Convert Role objects to their dict representations
+    :param roles: Role objects
+    :param depth: Depth to convert at
+    :param extra: Extra information
+    :return: Dict versions of the Roles
+    """
+    if depth > 0:
+        users = _dict_children(_role_users({role.id for role in roles}), max(depth - 1, 0))
+
+    result = []
+
+    for role in roles:
+        data = {
+            "id": role.id,
+            "name": role.name,
+            "description": role.description
+        }
+
+        if depth > 0:
+            data["users"] = _dict_list(users[role.id])
+
+        result.append(data)
+
+    return result
+
+
+def _dict_tables(tables: list, depth: int = 0, extra: bool = False) -> list:
+    """
+    Convert DataTable objects to their dict representations
+    :param tables: Table objects
+    :param depth: Depth to convert at
+    :param extra: Extra information
+    :return: Dict versions of the DataTables
+    """
+    if depth > 0:
+        table_ids = [table.id for table in tables]
+        columns = _dict_children(
+            [(column.table_id, column) for column in
+             DataColumn.query.filter(DataColumn.table_id.in_(table_ids)).order_by(DataColumn.id)],
+            max(depth - 1, 0)
+        )
+
+    result = []
+
+    for table in tables:
+        data = {
+            "id": table.id,
+            "name": table.name
+        }
+
+        if depth > 0:
+            data["columns"] = _dict_list(columns[table.id])
+
+        if extra:
+            data["version_id"] = table.version_id
+            data["loaded"] = table.loaded
+
+        result.append(data)
+
+    return result
+
+
+def _dict_users(users: list, depth: int = 0, extra: bool = False) -> list:
+    """
+    Convert User objects to their dict representations
+    :param users: User objects
+    :param depth: Depth to convert at
+    :param extra: Extra information
+    :return: Dict versions of the Users
+    """
+    if depth > 0:
+        user_ids = [user.id for user in users]
+        roles = _dict_children(
+            db.session.query(user_roles.c.user_id, Role).select_from(user_roles)
+            .join(Role, Role.id == user_roles.c.role_id)
+            .filter(user_roles.c.user_id.in_(user_ids)).order_by(Role.id).all(),
+            max(depth - 1, 0)
+        )
+        # A user can see the databases one of its roles gives access to
+        databases = _dict_children(
+            db.session.query(user_roles.c.user_id, Data).select_from(user_roles)
+            .join(Data, Data.access_role_id == user_roles.c.role_id)
+            .filter(user_roles.c.user_id.in_(user_ids)).order_by(Data.id).all(),
+            max(depth - 1, 0)
+        )
+
+    result = []
+
+    for user in users:
+        data = {
+            "id": user.id,
+            "username": user.username,
+            "active": user.active,
+            "firstname": user.first_name,
+            "lastname": user.last_name
+        }
+
+        if depth > 0:
+            data["roles"] = _dict_list(roles[user.id])
+            data["databases"] = _dict_list(databases[user.id])
+
+        result.append(data)
+
+    return result
+
+
+def _dict_versions(versions: list, depth: int = 0, extra: bool = False) -> list:
+    """
+    Convert DataVersion objects to their dict representations
+    :param versions: DataVersion objects
+    :param depth: Depth to convert at
+    :param extra: Extra information
+    :return: Dict versions of the DataVersions
+    """
+    if depth > 0:
+        version_ids = [version.id for version in versions]
+        tables = _dict_children(
+            [(table.version_id, table) for table in
+             DataTable.query.filter(DataTable.version_id.in_(version_ids)).order_by(DataTable.id)],
+            max(depth - 1, 0), extra
+        )
+
+    result = []
+
+    for version in versions:
+        data = {
+            "id": version.id,
+            "version": version.version,
+            "description": version.description
+        }
+
+        if depth > 0:
+            data["tables"] = _dict_list(tables[version.id])
+
+        if extra:
+            data["data_id"] = version.data_id
+            data["loaded"] = version.loaded
+
+        result.append(data)
+
+    return result
+
+
+_dict_batch_functions = {
+    Data: _dict_datas,
+    DataVersion: _dict_versions,
+    DataTable: _dict_tables,
+    DataColumn: _dict_columns,
+    User: _dict_users,
+    Role: _dict_roles
+}
 
 
 def _dict_column(column: DataColumn, depth: int = 0, extra: bool = False) -> dict:
@@ -116,18 +627,28 @@ def _dict_column(column: DataColumn, depth: int = 0, extra: bool = False) -> dic
     :param extra: Extra info
     :return: Dict representation of DataColumn
     """
-    data = {
-        "id": column.id,
-        "name": column.name
-    }
+    return _dict_columns([column], depth, extra)[0]
 
-    if depth > 0:
-        pass
 
-    if extra:
-        data["table_id"] = column.table_id
-
-    return data
+def _dict_dedup_job(job: DedupJob) -> dict:
+    """
+    Convert a deduplication job to a dict
+    :param job: Job to convert
+    :return: Dict representation of the job
+    """
+    return {
+        "id": job.id,
+        "status": job.status,
+        "table_id": job.table_id,
+        "column_id": job.column_id,
+        "column_name": job.column_name,
+        "method": job.method,
+        "threshold": job.threshold,
+        "clusters": job.cluster_count,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None
+    }
 
 
 def _dict_data(data: Data, depth: int = 0, extra: bool = False) -> dict:
@@ -138,22 +659,7 @@ def _dict_data(data: Data, depth: int = 0, extra: bool = False) -> dict:
     :param extra: Extra information
     :return: Dict version of Data
     """
-    d = {
-        "id": data.id,
-        "name": data.name,
-        "description": data.description,
-        "access_role": _dict_role(data.access_role, max(depth - 1, 0)),
-        "admin_role": _dict_role(data.admin_role, max(depth - 1, 0))
-    }
-
-    if depth > 0:
-        d["versions"] = _dict_query(data.versions, max(depth - 1, 0))
-        d["users"] = _dict_query(data.users, max(depth - 1, 0))
-
-    if extra:
-        pass
-
-    return d
+    return _dict_datas([data], depth, extra)[0]
 
 
 def _dict_role(role: Role, depth: int = 0, extra: bool = False) -> dict:
@@ -164,19 +670,7 @@ def _dict_role(role: Role, depth: int = 0, extra: bool = False) -> dict:
     :param extra: Extra information
     :return: Dict version of Role
     """
-    data = {
-        "id": role.id,
-        "name": role.name,
-        "description": role.description
-    }
-
-    if depth > 0:
-        data["users"] = _dict_query(role.users, max(depth - 1, 0))
-
-    if extra:
-        pass
-
-    return data
+    return _dict_roles([role], depth, extra)[0]
 
 
 def _dict_table(table: DataTable, depth: int = 0, extra: bool = False) -> dict:
@@ -187,19 +681,7 @@ def _dict_table(table: DataTable, depth: int = 0, extra: bool = False) -> dict:
     :param extra: Extra information
     :return: Dict version of DataTable
     """
-    data = {
-        "id": table.id,
-        "name": table.name
-    }
-
-    if depth > 0:
-        data["columns"] = _dict_query(table.columns, max(depth - 1, 0))
-
-    if extra:
-        data["version_id"] = table.version_id
-        data["loaded"] = table.loaded
-
-    return data
+    return _dict_tables([table], depth, extra)[0]
 
 
 def _dict_user(user: User, depth: int = 0, extra: bool = False) -> dict:
@@ -210,22 +692,7 @@ def _dict_user(user: User, depth: int = 0, extra: bool = False) -> dict:
     :param extra: Extra information
     :return: Dict version of User
     """
-    data = {
-        "id": user.id,
-        "username": user.username,
-        "active": user.active,
-        "firstname": user.first_name,
-        "lastname": user.last_name
-    }
-
-    if depth > 0:
-        data["roles"] = _dict_query(user.roles, max(depth - 1, 0))
-        data["databases"] = _dict_query(user.databases, max(depth - 1, 0))
-
-    if extra:
-        pass
-
-    return data
+    return _dict_users([user], depth, extra)[0]
 
 
 def _dict_version(version: DataVersion, depth: int = 0, extra: bool = False) -> dict:
@@ -236,20 +703,7 @@ def _dict_version(version: DataVersion, depth: int = 0, extra: bool = False) ->
     :param extra: Extra information
     :return: Dict version of DataVersion
     """
-    data = {
-        "id": version.id,
-        "version": version.version,
-        "description": version.description
-    }
-
-    if depth > 0:
-        data["tables"] = _dict_query(version.tables, max(depth - 1, 0), extra)
-
-    if extra:
-        data["data_id"] = version.data_id
-        data["loaded"] = version.loaded
-
-    return data
+    return _dict_versions([version], depth, extra)[0]
 
 
 # Resource classes
@@ -275,6 +729,108 @@ class RestColumnById(flask_restful.Resource):
         return flask.jsonify(_dict_column(column, 1))
 
 
+class RestColumnProfile(flask_restful.Resource):
+    @staticmethod
+    def get(column_id):
+        """
+        Profile a column in one streaming pass: nulls, approximate distinct count, min/max, mean/std,
+        approximate quantiles and the most frequent values
+        :param column_id: ID of the column to profile
+        :return: JSON object with the profile
+        """
+        column_id = _int(column_id, flask_security.current_user)
+
+        column: DataColumn = DataColumn.query.get(column_id)
+        _none_status(column)
+
+        # If the user is not authorized, return 403 Forbidden
+        if not column.table.version.data.is_user_auth(flask_security.current_user):
+            flask.abort(403)
+
+        fractions = [_float(f) for f in flask.request.args.get("quantiles", "0.01,0.05,0.25,0.5,0.75,0.95,0.99")
+                     .split(",") if f != ""]
+        if any(f < 0 or f > 1 for f in fractions):
+            flask.abort(400)
+        top = min(max(_int(flask.request.args.get("top", 10)), 0), 1000)
+
+        table: DataTable = column.table
+
+        def build():
+            result = sketch.profile(column.iter_values(), fractions, top)
+            result["id"] = column.id
+            return flask.Response(json.dumps(result, default=_json_default), mimetype="application/json")
+
+        # A profile is expensive on big tables, it stays valid until the table changes
+        return _cached_response(_etag("column_profile", column.id, table.id, table.revision, fractions, top), build)
+
+
+def _dedup_job(job_id) -> DedupJob:
+    """
+    Get a deduplication job the current user has access to, aborts otherwise
+    :param job_id: ID of the job
+    :return: The job
+    """
+    job_id = _int(job_id, flask_security.current_user)
+
+    job: DedupJob = DedupJob.query.get(job_id)
+    _none_status(job)
+
+    # If the user is not authorized, return 403 Forbidden
+    if not DataTable.query.get(job.table_id).version.data.is_user_auth(flask_security.current_user):
+        flask.abort(403)
+
+    job.fail_if_stale(flask.current_app.config.get("DEDUP_HEARTBEAT", 30))
+    return job
+
+
+class RestDedupJobById(flask_restful.Resource):
+    @staticmethod
+    def get(job_id):
+        """
+        Get the status of a deduplication job
+        :param job_id: ID of the job
+        :return: JSON object representing the job
+        """
+        return flask.jsonify(_dict_dedup_job(_dedup_job(job_id)))
+
+
+class RestDedupJobClusters(flask_restful.Resource):
+    @staticmethod
+    def get(job_id):
+        """
+        Get a page of the clusters of a finished deduplication job, biggest first.
+        ?cursor=<next_cursor of the previous page>&limit=<page size, at most 1000>
+        :param job_id: ID of the job
+        :return: JSON object with data, size and next_cursor
+        """
+        job = _dedup_job(job_id)
+        if not job.finished:
+            # Try again later
+            flask.abort(409)
+
+        limit = min(max(_int(flask.request.args.get("limit", 100)), 1), 1000)
+        query = job.clusters
+
+        # The cursor is the size and id of the last cluster of the previous page
+        cursor = flask.request.args.get("cursor")
+        if cursor is not None:
+            size, _, cluster_id = cursor.partition(":")
+            size, cluster_id = _int(size), _int(cluster_id)
+            query = query.filter(sqlalchemy.or_(
+                DedupCluster.size < size,
+                sqlalchemy.and_(DedupCluster.size == size, DedupCluster.id > cluster_id)
+            ))
+
+        # Ask for one more, to know if there is a next page
+        clusters = query.order_by(DedupCluster.size.desc(), DedupCluster.id).limit(limit + 1).all()
+        next_cursor = "%i:%i" % (clusters[limit - 1].size, clusters[limit - 1].id) if len(clusters) > limit else None
+
+        result = _dict_list([{"id": cluster.id, "value": cluster.value, "size": cluster.size,
+                              "neighbours": cluster.neighbours} for cluster in clusters[:limit]])
+        result["next_cursor"] = next_cursor
+        return flask.jsonify(result)
+
+
 class RestDatabase(flask_restful.Resource):
     @staticmethod
     def get():
@@ -286,7 +842,9 @@ class RestDatabase(flask_restful.Resource):
         if not _is_admin(flask_security.current_user):
             flask.abort(403)
 
-        return flask.jsonify(_dict_query(Data.query))
+        query = _filter_contains(Data.query, Data.name, "name")
+
+        return flask.jsonify(_dict_page(query, Data.id))
 
 
 class RestDatabaseById(flask_restful.Resource):
@@ -366,6 +924,78 @@ class RestDatabaseById(flask_restful.Resource):
         return "", 204
 
 
+class RestDatabaseTree(flask_restful.Resource):
+    @staticmethod
+    def get(data_id):
+        """
+        Get a database with all of its versions, their tables and the columns of those, in one response
+        :param data_id: ID of Data object
+        :return: JSON object representing the Data tree
+        """
+        data_id = _int(data_id, flask_security.current_user)
+
+        data: Data = Data.query.get(data_id)
+        _none_status(data)
+
+        # If the user is not authorized, return 403 Forbidden
+        if not data.is_user_auth(flask_security.current_user):
+            flask.abort(403)
+
+        # The tree only changes when versions or tables come or go, or a table changes its revision
+        token = db.session.query(
+            sqlalchemy.func.count(sqlalchemy.distinct(DataVersion.id)), sqlalchemy.func.max(DataVersion.id),
+            sqlalchemy.func.count(DataTable.id), sqlalchemy.func.max(DataTable.id),
+            sqlalchemy.func.coalesce(sqlalchemy.func.sum(DataTable.revision), 0)
+        ).select_from(DataVersion).outerjoin(DataTable, DataTable.version_id == DataVersion.id) \
+            .filter(DataVersion.data_id == data.id).one()
+
+        etag = _etag("database_tree", data.id, data.name, data.description, *token)
+        return _cached_response(etag, lambda: flask.jsonify(RestDatabaseTree._tree(data)))
+
+    @staticmethod
+    def _tree(data: Data) -> dict:
+        """
+        Build the tree of a Data object with a single query
+        :param data: Data object
+        :return: Dict with the same layout as the nested _dict_* representations
+        """
+        rows = db.session.query(
+            DataVersion.id, DataVersion.version, DataVersion.description,
+            DataTable.id, DataTable.name,
+            DataColumn.id, DataColumn.name
+        ).select_from(DataVersion) \
+            .outerjoin(DataTable, DataTable.version_id == DataVersion.id) \
+            .outerjoin(DataColumn, DataColumn.table_id == DataTable.id) \
+            .filter(DataVersion.data_id == data.id) \
+            .order_by(DataVersion.version, DataTable.id, DataColumn.id).all()
+
+        versions = collections.OrderedDict()
+        tables = collections.OrderedDict()
+
+        for version_id, version_number, description, table_id, table_name, column_id, column_name in rows:
+            if version_id not in versions:
+                versions[version_id] = {"id": version_id, "version": version_number, "description": description,
+                                        "tables": []}
+            # Outer joins, versions without tables and tables without columns still show up
+            if table_id is not None and table_id not in tables:
+                tables[table_id] = {"id": table_id, "name": table_name, "columns": []}
+                versions[version_id]["tables"].append(tables[table_id])
+            if column_id is not None:
+                tables[table_id]["columns"].append({"id": column_id, "name": column_name})
+
+        for table in tables.values():
+            table["columns"] = _dict_list(table["columns"])
+        for version in versions.values():
+            version["tables"] = _dict_list(version["tables"])
+
+        return {
+            "id": data.id,
+            "name": data.name,
+            "description": data.description,
+            "versions": _dict_list(list(versions.values()))
+        }
+
+
 class RestDatabaseUsers(flask_restful.Resource):
     @staticmethod
     def get(data_id):
@@ -421,7 +1051,9 @@ class RestRole(flask_restful.Resource):
         if not _is_admin(flask_security.current_user):
             flask.abort(403)
 
-        return flask.jsonify(_dict_query(Role.query))
+        query = _filter_contains(Role.query, Role.name, "name")
+
+        return flask.jsonify(_dict_page(query, Role.id))
 
 
 class RestRoleById(flask_restful.Resource):
@@ -457,18 +1089,10 @@ class RestRoleById(flask_restful.Resource):
         name = _get_from_request("name")
         description = _get_from_request("description")
 
-        change: bool = False
-
         if name:
-            role.name = name
-            change = True
+            role.change_name(name)
         if description:
-            role.description = description
-            change = True
-
-        if change:
-            db.session.add(role)
-            db.session.commit()
+            role.change_description(description)
 
         return "", 204
 
@@ -516,7 +1140,12 @@ class RestTable(flask_restful.Resource):
         if not _is_admin(flask_security.current_user):
             flask.abort(403)
 
-        return flask.jsonify(_dict_query(DataTable.query))
+        query = _filter_contains(DataTable.query, DataTable.name, "name")
+        query = _filter_bool(query, DataTable.loaded, "loaded")
+        if "version_id" in flask.request.args:
+            query = query.filter(DataTable.version_id == _int(flask.request.args["version_id"]))
+
+        return flask.jsonify(_dict_page(query, DataTable.id))
 
 
 class RestTableById(flask_restful.Resource):
@@ -532,7 +1161,8 @@ class RestTableById(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
-        return flask.jsonify(_dict_table(table, 1))
+        return _cached_response(_etag("table", table.id, table.revision),
+                                lambda: flask.jsonify(_dict_table(table, 1)))
 
     @staticmethod
     def post(table_id):
@@ -549,9 +1179,7 @@ class RestTableById(flask_restful.Resource):
         name = _get_from_request("name")
 
         if name:
-            table.name = name
-            db.session.add(table)
-            db.session.commit()
+            table.rename(name)
 
         return "", 204
 
@@ -569,7 +1197,8 @@ class RestTableColumns(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
-        return flask.jsonify(_dict_query(table.columns))
+        return _cached_response(_etag("table_columns", table.id, table.revision),
+                                lambda: flask.jsonify(_dict_query(table.columns)))
 
 
 def _verify_datatables_request(request):
@@ -596,12 +1225,101 @@ def _verify_datatables_request(request):
     return request
 
 
+def _content_request_from_args(args: werkzeug.datastructures.MultiDict) -> dict:
+    """
+    Build a content request like the DataTables one from query string arguments
+    ?start=0&length=10&order=<column index>:<asc|desc>,...&sample=1
+    :param args: Query string arguments
+    :return: Verified content request
+    """
+    order = []
+    for part in args.get("order", "").split(","):
+        column, _, direction = part.partition(":")
+        if column.isdigit():
+            order.append({"column": int(column), "dir": direction or "asc"})
+
+    return _verify_datatables_request({
+        "draw": 0,
+        "start": _int(args.get("start", 0)),
+        "length": _int(args.get("length", 10)),
+        "order": order,
+        "sample": _bool(args.get("sample"))
+    })
+
+
+def _table_content(table: DataTable, request: dict) -> flask.Response:
+    """
+    Get a page of the content of a table, in the format the client accepts
+    :param table: Table to get the content of
+    :param request: Verified content request with start, length and order
+    :return: Response with JSON or Arrow IPC stream content
+    """
+    mimetype = flask.request.accept_mimetypes.best_match(["application/json", DataTable.ARROW_MIMETYPE],
+                                                         "application/json")
+    arrow = mimetype == DataTable.ARROW_MIMETYPE
+
+    if request.get("sample") and request["length"] >= 0:
+        # A preview of random rows, only the sampled part of the table is read
+        q = table.sample_select(request["length"], raw=not arrow)
+        records = table.row_estimate()
+    else:
+        # Arrow carries the column names in its schema, so use the names the user sees
+        q = table.select() if arrow else table.select_clause()
+        records = table.row_count()
+
+        q = q.offset(request["start"])
+        # A negative length means all rows
+        if request["length"] >= 0:
+            q = q.limit(request["length"])
+
+    response = {"draw": int(request["draw"]), "recordsTotal": records, "recordsFiltered": records}
+
+    # Check ordering
+    columns = table.schema().column_ids
+    for order in request["order"]:
+        if order["column"] >= len(columns):
+            continue
+        if order["dir"].lower() == "asc":
+            q = q.order_by(db.column(str(columns[order["column"]])).asc())
+        else:
+            q = q.order_by(db.column(str(columns[order["column"]])).desc())
+
+    # Columns that are sorted on often get an index
+    column_index.record_usage(
+        table, [columns[order["column"]] for order in request["order"] if order["column"] < len(columns)], "sort"
+    )
+
+    if arrow:
+        try:
+            chunks = table.iter_arrow(q)
+        except TableError:
+            # No pyarrow available
+            flask.abort(406)
+        return flask.Response(flask.stream_with_context(chunks), mimetype=DataTable.ARROW_MIMETYPE,
+                              headers={"X-Records-Total": str(records), "X-Records-Filtered": str(records)})
+
+    # Stream the rows straight from a server-side cursor, for big pages and full table reads
+    if _bool(_get_from_request("stream")):
+        return _stream_json(response, "data", table.iter_rows(q))
+
+    dataframe = pandas.read_sql_query(q, db.session.connection())
+    response["data"] = dataframe.values.tolist()
+
+    # Return the jsonified dataframe
+    return flask.jsonify(response)
+
+
 class RestTableContent(flask_restful.Resource):
     @staticmethod
-    def post(table_id):
+    def get(table_id):
+        """
+        Get the content of a table, paged with the start, length and order query string arguments.
+        Send 'Accept: application/vnd.apache.arrow.stream' to get an Arrow IPC stream instead of JSON.
+        :param table_id: ID of the table
+        :return: Content of the table
+        """
         table_id = _int(table_id, flask_security.current_user)
 
-        # Try using input
         table: DataTable = DataTable.query.get(table_id)
         _none_status(table)
 
@@ -609,32 +1327,36 @@ class RestTableContent(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
-        json = flask.request.get_json()
-        _none_status(json)
-        json = _verify_datatables_request(json)
+        request = _content_request_from_args(flask.request.args)
+        _none_status(request)
+        if request["sample"]:
+            # A random sample is different every time, it is never cached
+            return _table_content(table, request)
 
-        q = table.select_clause()
-        records = db.session.connection().execute(q).rowcount
+        # The content depends on the paging arguments and the format the client accepts
+        etag = _etag("table_content", table.id, table.revision, sorted(flask.request.args.items(multi=True)),
+                     flask.request.accept_mimetypes.best_match(["application/json", DataTable.ARROW_MIMETYPE],
+                                                               "application/json"))
+        return _cached_response(etag, lambda: _table_content(table, request))
 
-        response = {"draw": int(json["draw"]), "recordsTotal": records, "recordsFiltered": records, "data": []}
+    @staticmethod
+    def post(table_id):
+        table_id = _int(table_id, flask_security.current_user)
 
-        q = q.offset(json["start"]).limit(json["length"])
+        # Try using input
+        table: DataTable = DataTable.query.get(table_id)
+        _none_status(table)
 
-        # Check ordering
-        for order in json["order"]:
-            if order["dir"].lower() == "asc":
-                q = q.order_by(table.columns.all()[order["column"]].sql_column_clause().asc())
-            else:
-                q = q.order_by(table.columns.all()[order["column"]].sql_column_clause().desc())
+        # If the user is not authorized, return 403 Forbidden
+        if not table.version.data.is_user_auth(flask_security.current_user):
+            flask.abort(403)
 
-        dataframe = pandas.read_sql_query(q, db.session.connection())
-        data = []
-        for x in dataframe:
-            data.append(dataframe[x].values.tolist())
-        response["data"] = dataframe.as_matrix().tolist()
+        request = flask.request.get_json()
+        _none_status(request)
+        request = _verify_datatables_request(request)
+        _none_status(request)
 
-        # Return the jsonified dataframe
-        return flask.jsonify(response)
+        return _table_content(table, request)
 
 
 class RestTransformJoin(flask_restful.Resource):
@@ -710,7 +1432,10 @@ class RestUser(flask_restful.Resource):
         if not _is_admin(flask_security.current_user):
             flask.abort(403)
 
-        return flask.jsonify(_dict_query(User.query))
+        query = _filter_contains(User.query, User.username, "username")
+        query = _filter_bool(query, User.active, "active")
+
+        return flask.jsonify(_dict_page(query, User.id))
 
 
 class RestUserById(flask_restful.Resource):
@@ -826,7 +1551,7 @@ class RestVersionById(flask_restful.Resource):
         if not version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
-        return flask.jsonify(_dict_version(version, 1))
+        return _cached_response(_version_etag("version", version), lambda: flask.jsonify(_dict_version(version, 1)))
 
 
 class RestVersionTables(flask_restful.Resource):
@@ -842,12 +1567,94 @@ class RestVersionTables(flask_restful.Resource):
         if not version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
-        return flask.jsonify(_dict_query(version.tables))
+        return _cached_response(_version_etag("version_tables", version),
+                                lambda: flask.jsonify(_dict_query(version.tables)))
 
 
 # Transformations
 # ======================================
 
+def _approximate_summary(table: DataTable, column_name: str, fractions: list = ()) -> dict:
+    """
+    Approximate the moments and quantiles of a column in one streaming pass, with bounded memory
+    :param table: Table the column is in
+    :param column_name: Name of the column
+    :param fractions: Fractions to get the quantiles for
+    :return: Summary as given by sketch.summarize, None if there is no such column
+    """
+    column_id = table.schema().name_to_id.get(column_name)
+    if column_id is None:
+        return None
+    return sketch.summarize(DataColumn.query.get(column_id).iter_values(), fractions)
+
+
+def _numeric_summary(table: DataTable, column_name: str, fractions: list = ()) -> dict:
+    """
+    Statistics pass over a column for a chunked transformation, min and max (fractions 0 and 1), mean and std are exact
+    :param table: Table the column is in
+    :param column_name: Name of the column
+    :param fractions: Fractions to get the quantiles for
+    :return: Summary as given by sketch.summarize, None if the column holds no numbers
+    """
+    summary = _approximate_summary(table, column_name, fractions)
+    return summary if summary and summary["count"] > 0 else None
+
+
+def _chunked(table: DataTable) -> bool:
+    """
+    Check whether to stream a table through a transformation chunk by chunk, because the request
+    asks for it or because the table is too big to load at once
+    :param table: Table to transform
+    :return: Whether to transform in chunks
+    """
+    if _bool(_get_from_request("chunked", flask.request)):
+        return True
+    return table.row_estimate() > flask.current_app.config.get("CHUNKED_TRANSFORM_ROWS", 5000000)
+
+
+def _transform_chunks(table: DataTable, apply, numeric_column: str = None):
+    """
+    Stream a table through a transformation in chunks of bounded size
+    :param table: Table to transform
+    :param apply: Function that transforms a chunk (dataframe) and returns it
+    :param numeric_column: Column with numbers, chunks with only nulls in it get a numeric type as well
+    :return: Generator of transformed chunks, at least one
+    """
+    chunk_size = flask.current_app.config.get("TRANSFORM_CHUNK_SIZE", 65536)
+
+    empty = True
+    for chunk in table.iter_dataframes(chunk_size=chunk_size):
+        empty = False
+        if numeric_column is not None and chunk[numeric_column].isna().all():
+            chunk[numeric_column] = chunk[numeric_column].astype(float)
+        yield apply(chunk)
+
+    if empty:
+        # The new table still needs its columns
+        yield apply(pandas.read_sql_query(table.select().limit(0), db.session.connection()))
+
+
+def _init_chunks(new_table: DataTable, chunks, table: DataTable, column_name: str) -> None:
+    """
+    Fill the table of a new version with transformed chunks, the version goes again if that fails halfway
+    :param new_table: Table of the new version
+    :param chunks: Chunks from _transform_chunks
+    :param table: Table the chunks come from
+    :param column_name: Column the transformation changes
+    """
+    # Untouched columns keep their types, even when the first chunk has only nulls in them.
+    # The transformed column gets the type of what comes out.
+    column_types = table.sql_column_types()
+    column_types.pop(column_name, None)
+
+    try:
+        new_table.init_chunks(chunks, column_types)
+    except Exception:
+        db.session.rollback()
+        delete_version(new_table.version_id)
+        raise
+
+
 class RestTransformChangeType(flask_restful.Resource):
     @staticmethod
     def post():
@@ -870,14 +1677,26 @@ class RestTransformChangeType(flask_restful.Resource):
             flask.abort(403)
 
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        df = transform.change_type(df, column_name, new_type)
+        chunks = None
+        if _chunked(table):
+            # Every chunk is parsed with the same datetime format, guessed once for the whole column
+            date_format = None
+            if new_type == "datetime" and column_name in table.schema().name_to_id:
+                date_format = transform.guess_datetime_format(table.distinct_values(column_name))
+            chunks = _transform_chunks(table, lambda chunk: transform.change_type(chunk, column_name, new_type,
+                                                                                  date_format))
+        else:
+            df: pandas.DataFrame = table.get_data(compact=True)
+            df = transform.change_type(df, column_name, new_type)
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "CHANGE TYPE OF %s TO %s" % (column_name, new_type)
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Return 204 No Content
         return "", 204
@@ -889,12 +1708,17 @@ class RestTransformDeduplication(flask_restful.Resource):
         # Process input
         database_id = _int(_get_from_request("db_id", flask.request), flask_security.current_user)
         column_name = _get_from_request("colinfo", flask.request)
-        max_distance = _int(_get_from_request("edit_distance", flask.request), flask_security.current_user)
+        method = _get_from_request("method", flask.request) or "levenshtein"
 
         # If input invalid, return 400 Bad Request if admin, 403 Forbidden otherwise
-        if column_name is None:
+        if column_name is None or (method != "levenshtein" and method not in transform.KEY_METHODS):
             flask.abort(400) if _is_admin(flask_security.current_user) else flask.abort(403)
 
+        # Only edit distance needs a threshold, the key methods group on equal keys
+        max_distance = 0
+        if method == "levenshtein":
+            max_distance = _int(_get_from_request("edit_distance", flask.request), flask_security.current_user)
+
         # Try getting the database
         version: DataVersion = Data.query.get(database_id).get_latest_version()
         table: DataTable = version.tables.filter(DataTable.loaded).first()
@@ -904,12 +1728,18 @@ class RestTransformDeduplication(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
-        # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        duplicates = transform.find_duplicates(df, column_name, max_distance)
+        column_id = table.schema().name_to_id.get(column_name)
+        _none_status(column_id)
 
-        # Return 204 No Content
-        return "", 204
+        # Finding duplicates takes a while on big columns, run it as a job and let the client poll it
+        job = DedupJob(DataColumn.query.get(column_id), max_distance, method)
+        job.start()
+
+        # Return 202 Accepted
+        response = flask.jsonify(_dict_dedup_job(job))
+        response.status_code = 202
+        response.headers["Location"] = flask.url_for("rest_api.restdedupjobbyid", job_id=job.id)
+        return response
 
 
 class RestTransformDeduplicationResult(flask_restful.Resource):
@@ -949,7 +1779,7 @@ class RestTransformDeduplicationResult(flask_restful.Resource):
             flask.abort(403)
 
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
+        df: pandas.DataFrame = table.get_data(compact=True)
         df = transform.replace_duplicates(df, column_name, to_replace, chain)
 
         # Write the operation
@@ -962,6 +1792,94 @@ class RestTransformDeduplicationResult(flask_restful.Resource):
         return "", 204
 
 
+def _record_linkage_request() -> (DataTable, dict):
+    """
+    Read and check a record linkage request, shared by finding and merging duplicate rows.
+    fields=<column>[:<weight>],... blocking=<column>[:<prefix length>][+<column>...],... threshold=<0..1>
+    :return: The table and the arguments for transform.find_record_duplicates
+    """
+    database_id = _int(_get_from_request("db_id", flask.request), flask_security.current_user)
+    fields_arg = _get_from_request("fields", flask.request)
+    blocking_arg = _get_from_request("blocking", flask.request)
+    threshold = _float(_get_from_request("threshold", flask.request) or 0.85, flask_security.current_user)
+
+    # If input invalid, return 400 Bad Request if admin, 403 Forbidden otherwise
+    if None in [fields_arg, blocking_arg] or not 0 <= threshold <= 1:
+        flask.abort(400) if _is_admin(flask_security.current_user) else flask.abort(403)
+
+    # Try getting the database
+    version: DataVersion = Data.query.get(database_id).get_latest_version()
+    table: DataTable = version.tables.filter(DataTable.loaded).first()
+    _none_status(table, flask_security.current_user, 422)
+
+    # If the user is not authorized, return 403 Forbidden
+    if not table.version.data.is_user_auth(flask_security.current_user):
+        flask.abort(403)
+
+    columns = table.schema().name_to_id
+    fields = {}
+    for part in fields_arg.split(","):
+        name, _, weight = part.rpartition(":") if ":" in part else (part, "", "1")
+        fields[name.strip()] = _float(weight, flask_security.current_user)
+    blocking = [spec.strip() for spec in blocking_arg.split(",") if spec.strip() != ""]
+
+    # Every column that is used has to exist
+    used = list(fields) + [part.partition(":")[0] for spec in blocking for part in spec.split("+")]
+    # Prefix lengths are counts of characters, not slices from the end
+    lengths = [_int(part.partition(":")[2], flask_security.current_user)
+               for spec in blocking for part in spec.split("+") if ":" in part]
+    if len(fields) == 0 or len(blocking) == 0 or any(name not in columns for name in used) \
+            or any(weight < 0 for weight in fields.values()) or any(length < 0 for length in lengths):
+        flask.abort(400) if _is_admin(flask_security.current_user) else flask.abort(403)
+
+    return table, {"fields": fields, "blocking": blocking, "threshold": threshold}
+
+
+class RestTransformRecordDeduplication(flask_restful.Resource):
+    @staticmethod
+    def post():
+        """
+        Find rows that are duplicates over several columns at once
+        :return: JSON object with the clusters of duplicate rows, biggest first
+        """
+        table, arguments = _record_linkage_request()
+
+        # Do the operation
+        df: pandas.DataFrame = table.get_data(compact=True)
+        clusters = transform.find_record_duplicates(df, **arguments)
+
+        # Show the compared fields of every row, so the clusters can be checked
+        rows = df[list(arguments["fields"])]
+        rows = rows.where(rows.notnull(), None)
+        result = _dict_list([{"size": len(cluster), "rows": rows.loc[cluster].to_dict("records")}
+                             for cluster in clusters])
+
+        return flask.Response(json.dumps(result, default=_json_default), mimetype="application/json")
+
+
+class RestTransformRecordDeduplicationResult(flask_restful.Resource):
+    @staticmethod
+    def post():
+        """
+        Merge rows that are duplicates over several columns, keeping the most complete row of every cluster
+        :return: 204 No Content
+        """
+        table, arguments = _record_linkage_request()
+
+        # Do the operation
+        df: pandas.DataFrame = table.get_data(compact=True)
+        df = transform.merge_record_duplicates(df, transform.find_record_duplicates(df, **arguments))
+
+        # Write the operation
+        new_version: DataVersion = table.version.data.get_next_version()
+        new_version.description = "MERGE DUPLICATE ROWS ON %s" % ", ".join(arguments["fields"])
+        new_table: DataTable = DataTable(new_version, table.name)
+        new_table.init_pandas(df)
+
+        # Return 204 No Content
+        return "", 204
+
+
 class RestTransformDeleteColumn(flask_restful.Resource):
     @staticmethod
     def post():
@@ -1014,15 +1932,29 @@ class RestTransformDiscretizeEquiDistance(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
-        # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        df = transform.discretize_equiwidth(df, column_name, nr_bins)
+        # Do the operation, big tables chunk by chunk with the bins from the minimum and maximum of a first pass
+        chunks = None
+        if _chunked(table):
+            summary = _numeric_summary(table, column_name, [0, 1])
+            if summary is None:
+                # Without the bounds of the whole column every chunk would get bins of its own
+                flask.abort(400) if _is_admin(flask_security.current_user) else flask.abort(403)
+            chunks = _transform_chunks(table,
+                                       lambda chunk: transform.discretize_equiwidth(chunk, column_name, nr_bins,
+                                                                                    *summary["quantiles"]),
+                                       column_name)
+        else:
+            df: pandas.DataFrame = table.get_data(compact=True)
+            df = transform.discretize_equiwidth(df, column_name, nr_bins)
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "DISCRETIZE (EQUIWIDTH) TO %i BINS IN %s" % (nr_bins, column_name)
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Return 204 No Content
         return "", 204
@@ -1035,9 +1967,10 @@ class RestTransformDiscretizeEquiFrequency(flask_restful.Resource):
         database_id = _int(_get_from_request("db_id", flask.request), flask_security.current_user)
         column_name = _get_from_request("colinfo", flask.request)
         nr_bins = _int(_get_from_request("nr_bins", flask.request), flask_security.current_user)
+        approximate = _bool(_get_from_request("approximate", flask.request))
 
         # If input invalid, return 400 Bad Request if admin, 403 Forbidden otherwise
-        if column_name is None:
+        if column_name is None or nr_bins < 1:
             flask.abort(400) if _is_admin(flask_security.current_user) else flask.abort(403)
 
         # Try getting the database
@@ -1049,15 +1982,39 @@ class RestTransformDiscretizeEquiFrequency(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
+        # Bin boundaries from a quantile sketch instead of sorting the whole column, always for chunks
+        chunked = _chunked(table)
+        boundaries = None
+        if approximate or chunked:
+            summary = _numeric_summary(table, column_name, [i / nr_bins for i in range(nr_bins + 1)])
+            if summary:
+                boundaries = summary["quantiles"]
+
+        # Without the quantiles of the whole column every chunk would get bins of its own
+        if chunked and boundaries is None:
+            flask.abort(400) if _is_admin(flask_security.current_user) else flask.abort(403)
+
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        df = transform.discretize_equifreq(df, column_name, nr_bins)
+        chunks = None
+        if chunked:
+            chunks = _transform_chunks(table,
+                                       lambda chunk: transform.discretize_equifreq(chunk, column_name, nr_bins,
+                                                                                   boundaries),
+                                       column_name)
+        else:
+            df: pandas.DataFrame = table.get_data(compact=True)
+            df = transform.discretize_equifreq(df, column_name, nr_bins, boundaries)
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "DISCRETIZE (EQUIFREQ) TO %i BINS IN %s" % (nr_bins, column_name)
+        if boundaries:
+            new_version.description += " (APPROXIMATE)"
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Return 204 No Content
         return "", 204
@@ -1090,7 +2047,7 @@ class RestTransformDiscretizeRanges(flask_restful.Resource):
             flask.abort(403)
 
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
+        df: pandas.DataFrame = table.get_data(compact=True)
         df = transform.discretize_ranges(df, column_name, boundaries)
 
         # Write the operation
@@ -1125,14 +2082,23 @@ class RestTransformExtractDateTime(flask_restful.Resource):
             flask.abort(403)
 
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        df = transform.extract_from_datetime(df, column_name, to_extract[5:])
+        chunks = None
+        if _chunked(table):
+            chunks = _transform_chunks(table,
+                                       lambda chunk: transform.extract_from_datetime(chunk, column_name,
+                                                                                     to_extract[5:]))
+        else:
+            df: pandas.DataFrame = table.get_data(compact=True)
+            df = transform.extract_from_datetime(df, column_name, to_extract[5:])
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "EXTRACT %s FROM DATETIME IN %s" % (to_extract, column_name)
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Return 204 No Content
         return "", 204
@@ -1146,6 +2112,7 @@ class RestTransformFillEmpty(flask_restful.Resource):
         column_name = _get_from_request("colinfo", flask.request)
         fill_with = _get_from_request("radio", flask.request)
         value = _get_from_request("replace_with", flask.request)
+        approximate = _bool(_get_from_request("approximate", flask.request))
 
         # If input invalid, return 400 Bad Request if admin, 403 Forbidden otherwise
         if None in [column_name, fill_with, value]:
@@ -1160,20 +2127,41 @@ class RestTransformFillEmpty(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
+        # The median from a quantile sketch instead of sorting the whole column, always for chunks.
+        # Chunks get the mean of the whole column from a first pass.
+        chunked = _chunked(table)
+        summary = None
+        if (approximate and fill_with == "median") or (chunked and fill_with in ["mean", "median"]):
+            summary = _numeric_summary(table, column_name, [0.5])
+        mean = summary["mean"] if summary and chunked else None
+        median = summary["quantiles"][0] if summary and fill_with == "median" else None
+
+        def fill(df: pandas.DataFrame) -> pandas.DataFrame:
+            if fill_with == "mean":
+                df = transform.fill_empty_mean(df, column_name, mean)
+            elif fill_with == "median":
+                df = transform.fill_empty_median(df, column_name, median)
+            elif fill_with == "value":
+                df = transform.fill_empty_value(df, column_name, value)
+            return df
+
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        if fill_with == "mean":
-            df = transform.fill_empty_mean(df, column_name)
-        elif fill_with == "median":
-            df = transform.fill_empty_median(df, column_name)
-        elif fill_with == "value":
-            df = transform.fill_empty_value(df, column_name, value)
+        chunks = None
+        if chunked:
+            chunks = _transform_chunks(table, fill, column_name if summary else None)
+        else:
+            df: pandas.DataFrame = fill(table.get_data(compact=True))
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "FILL EMPTY WITH %s IN %s" % (fill_with, column_name)
+        if median is not None:
+            new_version.description += " (APPROXIMATE)"
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Return 204 No Content
         return "", 204
@@ -1206,14 +2194,22 @@ class RestTransformFindReplace(flask_restful.Resource):
             flask.abort(403)
 
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        df = transform.find_replace(df, column_name, from_data, to_data)
+        chunks = None
+        if _chunked(table):
+            chunks = _transform_chunks(table,
+                                       lambda chunk: transform.find_replace(chunk, column_name, from_data, to_data))
+        else:
+            df: pandas.DataFrame = table.get_data(compact=True)
+            df = transform.find_replace(df, column_name, from_data, to_data)
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "FIND %s REPLACE %s IN %s" % (from_data, to_data, column_name)
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Respond
         return flask.Response(
@@ -1250,14 +2246,23 @@ class RestTransformFindReplaceRegex(flask_restful.Resource):
             flask.abort(403)
 
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        df = transform.find_replace_regex(df, column_name, from_data, to_data)
+        chunks = None
+        if _chunked(table):
+            chunks = _transform_chunks(table,
+                                       lambda chunk: transform.find_replace_regex(chunk, column_name, from_data,
+                                                                                  to_data))
+        else:
+            df: pandas.DataFrame = table.get_data(compact=True)
+            df = transform.find_replace_regex(df, column_name, from_data, to_data)
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "FIND %s REPLACE %s IN %s" % (from_data, to_data, column_name)
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Return 204 No Content
         return "", 204
@@ -1283,15 +2288,25 @@ class RestTransformNormalize(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
-        # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        df = transform.normalize(df, column_name)
+        # Do the operation, big tables chunk by chunk with the minimum and maximum of a first pass
+        chunks = None
+        if _chunked(table):
+            summary = _numeric_summary(table, column_name, [0, 1])
+            bounds = summary["quantiles"] if summary else [None, None]
+            chunks = _transform_chunks(table, lambda chunk: transform.normalize(chunk, column_name, *bounds),
+                                       column_name if summary else None)
+        else:
+            df: pandas.DataFrame = table.get_data(compact=True)
+            df = transform.normalize(df, column_name)
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "NORMALIZE %s" % column_name
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Return 204 No Content
         return "", 204
@@ -1319,7 +2334,7 @@ class RestTransformOneHotEncoding(flask_restful.Resource):
             flask.abort(403)
 
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
+        df: pandas.DataFrame = table.get_data(compact=True)
         df = transform.one_hot_encode(df, column_name, use_old_name)
 
         # Write the operation
@@ -1339,6 +2354,7 @@ class RestTransformRemoveOutliers(flask_restful.Resource):
         database_id = _int(_get_from_request("db_id", flask.request), flask_security.current_user)
         column_name = _get_from_request("colinfo", flask.request)
         outside_range = _float(_get_from_request("range", flask.request), flask_security.current_user)
+        approximate = _bool(_get_from_request("approximate", flask.request))
 
         # If input invalid, return 400 Bad Request if admin, 403 Forbidden otherwise
         if column_name is None:
@@ -1353,15 +2369,32 @@ class RestTransformRemoveOutliers(flask_restful.Resource):
         if not table.version.data.is_user_auth(flask_security.current_user):
             flask.abort(403)
 
+        # Mean and std in a streaming pass, always for chunks
+        chunked = _chunked(table)
+        summary = _numeric_summary(table, column_name) if approximate or chunked else None
+        mean, std = (summary["mean"], summary["std"]) if summary else (None, None)
+
         # Do the operation
-        df: pandas.DataFrame = table.get_data()
-        df = transform.remove_outliers(df, column_name, outside_range)
+        chunks = None
+        if chunked:
+            chunks = _transform_chunks(table,
+                                       lambda chunk: transform.remove_outliers(chunk, column_name, outside_range,
+                                                                               mean, std),
+                                       column_name if summary else None)
+        else:
+            df: pandas.DataFrame = table.get_data(compact=True)
+            df = transform.remove_outliers(df, column_name, outside_range, mean, std)
 
         # Write the operation
         new_version: DataVersion = table.version.data.get_next_version()
         new_version.description = "REMOVE OUTLIERS WITH RANGE %f IN %s" % (outside_range, column_name)
+        if summary and approximate:
+            new_version.description += " (APPROXIMATE)"
         new_table: DataTable = DataTable(new_version, table.name)
-        new_table.init_pandas(df)
+        if chunks is None:
+            new_table.init_pandas(df)
+        else:
+            _init_chunks(new_table, chunks, table, column_name)
 
         # Return 204 No Content
         return "", 204
@@ -1416,8 +2449,12 @@ restful_api: flask_restful.Api = flask_restful.Api(restful_blueprint,
 
 # Add endpoints
 restful_api.add_resource(RestColumnById, "/column/<column_id>/")
+restful_api.add_resource(RestColumnProfile, "/column/<column_id>/profile/")
 restful_api.add_resource(RestDatabase, "/database/")
+restful_api.add_resource(RestDedupJobById, "/dedup/<job_id>/")
+restful_api.add_resource(RestDedupJobClusters, "/dedup/<job_id>/cluster/")
 restful_api.add_resource(RestDatabaseById, "/database/<data_id>/")
+restful_api.add_resource(RestDatabaseTree, "/database/<data_id>/tree/")
 restful_api.add_resource(RestDatabaseUsers, "/database/<data_id>/user/")
 restful_api.add_resource(RestRole, "/role/")
 restful_api.add_resource(RestRoleById, "/role/<role_id>/")
@@ -1436,6 +2473,8 @@ restful_api.add_resource(RestTransformChangeType, "/transform/change_type/")
 restful_api.add_resource(RestTransformDeduplication, "/transform/deduplication")
 restful_api.add_resource(RestTransformDeduplicationResult, "/transform/deduplication_result")
 restful_api.add_resource(RestTransformDeleteColumn, "/transform/delete_column/")
+restful_api.add_resource(RestTransformRecordDeduplication, "/transform/record_deduplication/")
+restful_api.add_resource(RestTransformRecordDeduplicationResult, "/transform/record_deduplication_result/")
 restful_api.add_resource(RestTransformDiscretizeEquiDistance, "/transform/discretize_distance/")
 restful_api.add_resource(RestTransformDiscretizeEquiFrequency, "/transform/discretize_frequency/")
 restful_api.add_resource(RestTransformDiscretizeRanges, "/transform/discretize_ranges")
@@ -0,0 +1,371 @@
+import math
+import typing
+
+import numpy as np
+import pandas as pd
+import pandas.api.types as types
+
+
+""" Hashing """
+
+
+def hash_values(series: pd.Series) -> np.ndarray:
+    """
+    Hash the values of a series to 64 bit integers, equal values get equal hashes
+    no matter in which chunk (and so with which dtype) they show up
+    :param series: Values to hash, without nulls
+    :return: Array of uint64 hashes
+    """
+    if types.is_numeric_dtype(series) and not types.is_bool_dtype(series):
+        series = series.astype("float64")
+    return pd.util.hash_pandas_object(series, index=False).values
+
+
+""" Distinct count """
+
+
+class HyperLogLog(object):
+    """HyperLogLog sketch for the approximate amount of distinct values, about 1% error with the default precision"""
+
+    def __init__(self, precision: int = 14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, series: pd.Series) -> None:
+        """
+        Add values to the sketch
+        :param series: Values to add, without nulls
+        """
+        if len(series) == 0:
+            return
+
+        hashes = hash_values(series)
+        width = 64 - self.precision
+
+        # The first bits pick the register, the position of the first set bit in the rest is the rank
+        index = (hashes >> np.uint64(width)).astype(np.int64)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # Exact for values below 2 ** 53, frexp gives the bit length as exponent
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (width - bit_length + 1).astype(np.uint8)
+
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Add all values of another sketch with the same precision to this one"""
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        """
+        Get the estimated amount of distinct values
+        :return: Estimate
+        """
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+
+        # Small cardinalities are estimated better by counting empty registers
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros > 0:
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+
+""" Quantiles """
+
+
+class QuantileSketch(object):
+    """
+    KLL quantile sketch, keeps about 3k numbers no matter how many are added.
+    The rank error of a quantile is in the order of 1 / k.
+    """
+
+    def __init__(self, k: int = 200, seed: int = None):
+        self.k = k
+        self.count = 0
+        self.levels: typing.List[np.ndarray] = [np.empty(0)]
+        self.random = np.random.RandomState(seed)
+
+    def _capacity(self, level: int) -> int:
+        # Higher levels hold heavier items, lower levels get geometrically smaller
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Add numbers to the sketch
+        :param values: Numbers to add, without NaN
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Add all numbers of another sketch to this one"""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate((self.levels[level], items))
+        self.count += other.count
+        self._compress()
+
+    def _compress(self) -> None:
+        compacted = True
+        while compacted:
+            compacted = False
+            for level in range(len(self.levels)):
+                items = self.levels[level]
+                if len(items) <= self._capacity(level):
+                    continue
+
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+
+                items = np.sort(items)
+                # An odd item out stays behind
+                leftover = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+
+                # Every other item moves up with double the weight, starting at a random one of the first two
+                promoted = items[self.random.randint(2)::2]
+                self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted))
+                self.levels[level] = leftover
+                compacted = True
+
+    def quantiles(self, fractions: typing.Iterable[float]) -> typing.List[typing.Optional[float]]:
+        """
+        Get approximate quantiles
+        :param fractions: Fractions between 0 and 1 to get the quantiles for
+        :return: Quantile for every fraction, None when the sketch is empty
+        """
+        fractions = list(fractions)
+        if self.count == 0:
+            return [None for _ in fractions]
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2 ** level, dtype=np.float64)
+                                  for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind="mergesort")
+        items = items[order]
+        cumulative = np.cumsum(weights[order])
+
+        result = []
+        for fraction in fractions:
+            position = np.searchsorted(cumulative, fraction * cumulative[-1], side="left")
+            result.append(float(items[min(position, len(items) - 1)]))
+        return result
+
+
+""" Frequent values """
+
+
+class TopK(object):
+    """
+    Misra-Gries summary of the most frequent values. The kept counts are lower bounds,
+    off by at most (amount of values) / (capacity + 1).
+    """
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counters: typing.Dict[typing.Any, int] = dict()
+
+    def update(self, series: pd.Series) -> None:
+        """
+        Add values to the summary
+        :param series: Values to add, without nulls
+        """
+        for value, count in series.value_counts().items():
+            self.counters[value] = self.counters.get(value, 0) + int(count)
+        self._reduce()
+
+    def merge(self, other: "TopK") -> None:
+        """Add all values of another summary to this one"""
+        for value, count in other.counters.items():
+            self.counters[value] = self.counters.get(value, 0) + count
+        self._reduce()
+
+    def _reduce(self) -> None:
+        if len(self.counters) <= self.capacity:
+            return
+
+        # Subtract the count of the first value that does not fit from all, keep what stays positive
+        cut = sorted(self.counters.values(), reverse=True)[self.capacity]
+        self.counters = {value: count - cut for value, count in self.counters.items() if count > cut}
+
+    def top(self, k: int) -> typing.List[typing.Tuple[typing.Any, int]]:
+        """
+        Get the most frequent values
+        :param k: Amount of values to get, at most the capacity
+        :return: (value, count) pairs, most frequent first
+        """
+        return sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+""" Moments """
+
+
+class Moments(object):
+    """Count, minimum, maximum, mean and variance, merged chunk by chunk"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Add numbers
+        :param values: Numbers to add, without NaN
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+
+        count = len(values)
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+
+        # Combine the running and the chunk aggregates (Chan et al.)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+        self.min = float(values.min()) if self.min is None else min(self.min, float(values.min()))
+        self.max = float(values.max()) if self.max is None else max(self.max, float(values.max()))
+
+    def std(self) -> typing.Optional[float]:
+        """Sample standard deviation, like pandas"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+
+
+""" Column profile """
+
+
+class ColumnProfile(object):
+    """All sketches of a column together, fed with the column chunk by chunk"""
+
+    def __init__(self, top_capacity: int = 100, quantile_k: int = 200):
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.numeric = True
+        self.distinct = HyperLogLog()
+        self.frequent = TopK(top_capacity)
+        self.moments = Moments()
+        self.quantile_sketch = QuantileSketch(quantile_k)
+
+    def update(self, series: pd.Series) -> None:
+        """
+        Add a chunk of the column
+        :param series: Chunk of values
+        """
+        values = series.dropna()
+        self.count += len(series)
+        self.nulls += len(series) - len(values)
+
+        if len(values) == 0:
+            return
+
+        self.distinct.update(values)
+        self.frequent.update(values)
+
+        if types.is_numeric_dtype(values) and not types.is_bool_dtype(values):
+            numbers = values.values.astype(np.float64)
+            numbers = numbers[np.isfinite(numbers)]
+            self.moments.update(numbers)
+            self.quantile_sketch.update(numbers)
+        else:
+            # A single chunk of something else makes the whole column non-numeric
+            self.numeric = False
+
+        # Ordering works for any type the database can sort
+        chunk_min, chunk_max = values.min(), values.max()
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+
+    def result(self, fractions: typing.Iterable[float], k: int) -> dict:
+        """
+        Get the profile
+        :param fractions: Fractions to get the approximate quantiles for
+        :param k: Amount of frequent values to return
+        :return: Profile of the column
+        """
+        fractions = list(fractions)
+        numeric = self.numeric and self.moments.count > 0
+
+        return {
+            "count": self.count,
+            "nulls": self.nulls,
+            "distinct_estimate": self.distinct.estimate(),
+            "min": _python_value(self.min),
+            "max": _python_value(self.max),
+            "mean": self.moments.mean if numeric else None,
+            "std": self.moments.std() if numeric else None,
+            "quantiles": ([{"fraction": f, "value": v}
+                           for f, v in zip(fractions, self.quantile_sketch.quantiles(fractions))]
+                          if numeric else []),
+            "top": [{"value": _python_value(value), "count": count} for value, count in self.frequent.top(k)],
+        }
+
+
+def summarize(chunks: typing.Iterable[pd.Series], fractions: typing.Iterable[float] = (), k: int = 200) -> dict:
+    """
+    Approximate the moments and quantiles of a numeric column in one pass over its chunks
+    :param chunks: Chunks of the column
+    :param fractions: Fractions to get the quantiles for
+    :param k: Accuracy of the quantile sketch, see QuantileSketch
+    :return: Count, mean, std and a quantile per fraction, None when the column holds no numbers
+    """
+    fractions = list(fractions)
+    moments = Moments()
+    quantile_sketch = QuantileSketch(k)
+
+    for chunk in chunks:
+        values = chunk.dropna()
+        if len(values) == 0:
+            continue
+        if not types.is_numeric_dtype(values) or types.is_bool_dtype(values):
+            moments = Moments()
+            break
+
+        numbers = values.values.astype(np.float64)
+        numbers = numbers[np.isfinite(numbers)]
+        moments.update(numbers)
+        quantile_sketch.update(numbers)
+
+    if moments.count == 0:
+        return {"count": 0, "mean": None, "std": None, "quantiles": [None for _ in fractions]}
+
+    # The sketch may have dropped the extremes, those are known exactly
+    quantiles = [moments.min if f <= 0 else moments.max if f >= 1 else q
+                 for f, q in zip(fractions, quantile_sketch.quantiles(fractions))]
+
+    return {"count": moments.count, "mean": moments.mean, "std": moments.std(), "quantiles": quantiles}
+
+
+def _python_value(value):
+    """Turn numpy scalars into plain Python values"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def profile(chunks: typing.Iterable[pd.Series], fractions: typing.Iterable[float], k: int = 10) -> dict:
+    """
+    Profile a column in one pass over its chunks
+    :param chunks: Chunks of the column
+    :param fractions: Fractions to get the approximate quantiles for
+    :param k: Amount of frequent values to return
+    :return: Profile of the column
+    """
+    column_profile = ColumnProfile(top_capacity=max(100, 10 * k))
+    for chunk in chunks:
+        column_profile.update(chunk)
+    return column_profile.result(fractions, k)
@@ -1,25 +1,42 @@
 
+import collections
+import concurrent.futures
+import datetime
+import itertools
+import multiprocessing
+import multiprocessing.util
+import re
+import sys
+import unicodedata
+from multiprocessing import shared_memory
+
+import numpy as np
 import pandas as pd
 import pandas.api.types as types
 
 from Levenshtein.StringMatcher import distance
 
+import compaction
+
 
 """ Find and replace """
 
 
 def find_replace(dataframe: pd.DataFrame, column_name: str, to_replace, value) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     dataframe[column_name].replace(to_replace, value, inplace=True)
     return dataframe
 
 
 def find_replace_regex(dataframe: pd.DataFrame, column_name: str, to_replace: str, value: str) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     if types.is_string_dtype(dataframe[column_name]):
         dataframe[column_name].replace(to_replace, value, inplace=True, regex=True)
     return dataframe
 
 
 def find_replace_all(dataframe: pd.DataFrame, to_replace, value) -> pd.DataFrame:
+    compaction.expand(dataframe)
     dataframe.replace(to_replace, value, inplace=True)
     return dataframe
 
@@ -27,15 +44,21 @@ def find_replace_all(dataframe: pd.DataFrame, to_replace, value) -> pd.DataFrame
 """ Normalization """
 
 
-def normalize(dataframe: pd.DataFrame, column_name: str) -> pd.DataFrame:
+def normalize(dataframe: pd.DataFrame, column_name: str,
+              minimum: float = None, maximum: float = None) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     col = dataframe[column_name]
     if not types.is_numeric_dtype(col):
         return dataframe
-    dataframe[column_name] = (col - col.min()) / (col.max() - col.min())
+    # Minimum and maximum can be given, for instance when the column comes in chunks
+    minimum = col.min() if minimum is None else minimum
+    maximum = col.max() if maximum is None else maximum
+    dataframe[column_name] = (col - minimum) / (maximum - minimum)
     return dataframe
 
 
 def normalize_all(dataframe: pd.DataFrame) -> pd.DataFrame:
+    compaction.expand(dataframe)
     func = {False: lambda col: col,
             True: lambda col: (col - col.min()) / (col.max() - col.min())}
     return dataframe.transform(lambda col: func[types.is_numeric_dtype(dataframe[col.name])](col))
@@ -44,14 +67,20 @@ def normalize_all(dataframe: pd.DataFrame) -> pd.DataFrame:
 """ Outliers """
 
 
-def remove_outliers(dataframe: pd.DataFrame, column_name: str, outside_range: float) -> pd.DataFrame:
+def remove_outliers(dataframe: pd.DataFrame, column_name: str, outside_range: float,
+                    mean: float = None, std: float = None) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     col = dataframe[column_name]
     if not types.is_numeric_dtype(col):
         return dataframe
-    return dataframe[(col - col.mean()).abs() <= (col.std() * outside_range)]
+    # Mean and std can be given, for instance approximated beforehand on a huge table
+    mean = col.mean() if mean is None else mean
+    std = col.std() if std is None else std
+    return dataframe[(col - mean).abs() <= (std * outside_range)]
 
 
 def remove_all_outliers(dataframe: pd.DataFrame, outside_range: float) -> pd.DataFrame:
+    compaction.expand(dataframe)
     return dataframe[dataframe.apply(lambda col:
                                      not types.is_numeric_dtype(dataframe[col.name])
                                      or (col - col.mean()).abs() <= (outside_range * col.std())).all(axis=1)]
@@ -60,32 +89,39 @@ def remove_all_outliers(dataframe: pd.DataFrame, outside_range: float) -> pd.Dat
 """ Empty fields """
 
 
-def fill_empty_mean(dataframe: pd.DataFrame, column_name: str) -> pd.DataFrame:
+def fill_empty_mean(dataframe: pd.DataFrame, column_name: str, mean: float = None) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     if not types.is_numeric_dtype(dataframe[column_name]):
         return dataframe
-    dataframe[column_name] = dataframe[column_name].fillna(dataframe[column_name].mean())
+    mean = dataframe[column_name].mean() if mean is None else mean
+    dataframe[column_name] = dataframe[column_name].fillna(mean)
     return dataframe
 
 
-def fill_empty_median(dataframe: pd.DataFrame, column_name: str) -> pd.DataFrame:
+def fill_empty_median(dataframe: pd.DataFrame, column_name: str, median: float = None) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     if not types.is_numeric_dtype(dataframe[column_name]):
         return dataframe
-    dataframe[column_name] = dataframe[column_name].fillna(dataframe[column_name].median())
+    median = dataframe[column_name].median() if median is None else median
+    dataframe[column_name] = dataframe[column_name].fillna(median)
     return dataframe
 
 
 def fill_empty_value(dataframe: pd.DataFrame, column_name: str, value) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     dataframe[column_name] = dataframe[column_name].fillna(value)
     return dataframe
 
 
 def fill_all_empty_mean(dataframe: pd.DataFrame) -> pd.DataFrame:
+    compaction.expand(dataframe)
     func = {False: lambda col: col,
             True: lambda col: col.fillna(col.mean())}
     return dataframe.apply(lambda col: func[types.is_numeric_dtype(dataframe[col.name])](col))
 
 
 def fill_all_empty_median(dataframe: pd.DataFrame) -> pd.DataFrame:
+    compaction.expand(dataframe)
     func = {False: lambda col: col,
             True: lambda col: col.fillna(col.median())}
     return dataframe.apply(lambda col: func[types.is_numeric_dtype(dataframe[col.name])](col))
@@ -94,19 +130,48 @@ def fill_all_empty_median(dataframe: pd.DataFrame) -> pd.DataFrame:
 """ Discretization """
 
 
-def discretize_equiwidth(dataframe: pd.DataFrame, column_name: str, nr_bins: int) -> pd.DataFrame:
+def _equiwidth_bins(minimum: float, maximum: float, nr_bins: int) -> np.ndarray:
+    """
+    Get the bins pd.cut makes for an amount of bins, from the minimum and maximum of the whole column
+    """
+    if minimum == maximum:
+        adjust = 0.001 * abs(minimum) if minimum != 0 else 0.001
+        return np.linspace(minimum - adjust, maximum + adjust, nr_bins + 1)
+
+    bins = np.linspace(minimum, maximum, nr_bins + 1)
+    # The lowest edge moves down a bit, so the minimum falls in the first bin
+    bins[0] -= (maximum - minimum) * 0.001
+    return bins
+
+
+def discretize_equiwidth(dataframe: pd.DataFrame, column_name: str, nr_bins: int,
+                         minimum: float = None, maximum: float = None) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     if types.is_numeric_dtype(dataframe[column_name]):
-        dataframe[column_name] = pd.cut(dataframe[column_name], nr_bins).apply(str)
+        if minimum is None or maximum is None:
+            dataframe[column_name] = pd.cut(dataframe[column_name], nr_bins).apply(str)
+        else:
+            # Same bins in every chunk of the column
+            dataframe[column_name] = pd.cut(dataframe[column_name],
+                                            _equiwidth_bins(minimum, maximum, nr_bins)).apply(str)
     return dataframe
 
 
-def discretize_equifreq(dataframe: pd.DataFrame, column_name: str, nr_bins: int) -> pd.DataFrame:
+def discretize_equifreq(dataframe: pd.DataFrame, column_name: str, nr_bins: int,
+                        boundaries: [float] = None) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     if types.is_numeric_dtype(dataframe[column_name]):
-        dataframe[column_name] = pd.qcut(dataframe[column_name], nr_bins).apply(str)
+        if boundaries is None:
+            dataframe[column_name] = pd.qcut(dataframe[column_name], nr_bins).apply(str)
+        else:
+            # Quantiles computed beforehand, the outer ones are the minimum and maximum
+            dataframe[column_name] = pd.cut(dataframe[column_name], sorted(set(boundaries)),
+                                            include_lowest=True).apply(str)
     return dataframe
 
 
 def discretize_ranges(dataframe: pd.DataFrame, column_name: str, boundaries: [float]) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     col = dataframe[column_name]
     if types.is_numeric_dtype(col):
         boundaries.sort()
@@ -125,6 +190,7 @@ def discretize_ranges(dataframe: pd.DataFrame, column_name: str, boundaries: [fl
 
 
 def one_hot_encode(dataframe: pd.DataFrame, column_name: str, use_old_name: bool) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     if types.is_string_dtype(dataframe[column_name]):
         encoded_frame = pd.get_dummies(dataframe[column_name])
 
@@ -142,16 +208,108 @@ def one_hot_encode(dataframe: pd.DataFrame, column_name: str, use_old_name: bool
 """ Type changing """
 
 
-def change_type(dataframe: pd.DataFrame, column_name: str, new_type: str) -> pd.DataFrame:
+# Tried in this order, month before day like pd.to_datetime
+_datetime_formats = [
+    "%Y-%m-%d", "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f",
+    "%Y/%m/%d", "%Y/%m/%d %H:%M", "%Y/%m/%d %H:%M:%S",
+    "%m/%d/%Y", "%m/%d/%Y %H:%M", "%m/%d/%Y %H:%M:%S",
+    "%d/%m/%Y", "%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S",
+    "%m-%d-%Y", "%d-%m-%Y", "%d.%m.%Y", "%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S",
+    "%Y%m%d", "%d %B %Y", "%d %b %Y", "%B %d, %Y", "%b %d, %Y",
+]
+
+
+def _infer_datetime_format(sample: [str]) -> str:
+    """
+    Find a format that parses all strings of a sample
+    :return: strptime format or None if no known format fits
+    """
+    for date_format in _datetime_formats:
+        try:
+            for string in sample:
+                datetime.datetime.strptime(string, date_format)
+        except ValueError:
+            continue
+        return date_format
+    return None
+
+
+# Format that tells change_type none fits, so every value is parsed on its own
+NO_DATETIME_FORMAT = ""
+
+
+def guess_datetime_format(strings: [str]) -> str:
+    """
+    Guess the format of a datetime column once, so all chunks of it are parsed the same way
+    :param strings: Sample of the distinct strings of the column, the first 100 are used
+    :return: strptime format or NO_DATETIME_FORMAT if no known format fits
+    """
+    strings = [string.strip() for string in strings if isinstance(string, str)][:100]
+    return _infer_datetime_format(strings) or NO_DATETIME_FORMAT
+
+
+def _convert_distinct(col: pd.Series, convert) -> pd.Series:
+    """
+    Convert only the distinct values of a column and map the results back, missing values stay missing
+    :param col: Column to convert
+    :param convert: Vectorized conversion of a series of distinct values
+    :return: Converted column
+    """
+    codes, uniques = pd.factorize(col)
+    converted = convert(pd.Series(uniques))
+    values = pd.api.extensions.take(converted.values, codes, allow_fill=True)
+    return pd.Series(values, index=col.index, name=col.name)
+
+
+def _parse_datetimes(values: pd.Series, date_format: str = None) -> pd.Series:
+    """
+    Parse distinct values to datetimes. Strings are parsed with one format, guessed from a sample when
+    not given. Whatever does not fit it goes to pd.to_datetime one value at a time, like everything
+    that is not a string, so every leftover gets a format of its own.
+    """
+    strings = values[values.map(lambda value: isinstance(value, str)).astype(bool)].str.strip()
+    if date_format is None:
+        date_format = guess_datetime_format(strings.tolist())
+
+    parsed = pd.Series(pd.NaT, index=values.index)
+    if date_format != NO_DATETIME_FORMAT:
+        parsed[strings.index] = pd.to_datetime(strings, format=date_format, errors="coerce")
+
+    rest = parsed.isnull()
+    if rest.any():
+        parsed[rest] = values[rest].map(pd.to_datetime)
+    return parsed
+
+
+def _to_float(col: pd.Series) -> pd.Series:
+    if types.is_object_dtype(col) or types.is_string_dtype(col):
+        # Strings of numbers, every distinct one is parsed once
+        return _convert_distinct(col, lambda values: values.astype(float))
+    return col.astype(float)
+
+
+def change_type(dataframe: pd.DataFrame, column_name: str, new_type: str, date_format: str = None) -> pd.DataFrame:
+    """
+    Convert a column to another type, vectorized. Integers are rounded half to even like round()
+    and nullable, so missing values stay missing. Datetimes are parsed with date_format, from
+    guess_datetime_format, or with a format guessed from the column itself when not given.
+    """
+    compaction.expand(dataframe, [column_name])
     col = dataframe[column_name]
     if new_type == 'string':
         dataframe[column_name] = col.astype(str)
     elif new_type == 'int':
-        dataframe[column_name] = col.astype(float).transform(round).astype(int)
+        dataframe[column_name] = np.round(_to_float(col)).astype("Int64")
     elif new_type == 'float':
-        dataframe[column_name] = col.astype(float)
+        dataframe[column_name] = _to_float(col)
     elif new_type == 'datetime':
-        dataframe[column_name] = col.apply(pd.to_datetime)
+        if types.is_datetime64_any_dtype(col):
+            return dataframe
+        elif types.is_object_dtype(col) or types.is_string_dtype(col):
+            dataframe[column_name] = _convert_distinct(col, lambda values: _parse_datetimes(values, date_format))
+        else:
+            dataframe[column_name] = pd.to_datetime(col)
     return dataframe
 
 
@@ -159,6 +317,7 @@ def change_type(dataframe: pd.DataFrame, column_name: str, new_type: str) -> pd.
 
 
 def extract_from_datetime(dataframe: pd.DataFrame, column_name: str, to_extract: str) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     col = dataframe[column_name]
     if types.is_datetime64_any_dtype(col):
         if to_extract == 'year':
@@ -177,92 +336,524 @@ def extract_from_datetime(dataframe: pd.DataFrame, column_name: str, to_extract:
 """ Data deduplication """
 
 
-def find_duplicates(dataframe: pd.DataFrame, column_name: str, threshold: int) -> dict:
+def _qgram_tokens(string: str, q: int) -> [str]:
+    """
+    Get the padded q-grams of a string, a string of length n has n + q - 1 of them.
+    Repeated grams get their occurrence number appended, so they stay apart in sets.
+    """
+    padded = "\x01" * (q - 1) + string + "\x02" * (q - 1)
+    seen: {str: int} = {}
+    tokens: [str] = []
+    for k in range(len(padded) - q + 1):
+        gram = padded[k:k + q]
+        seen[gram] = seen.get(gram, 0) + 1
+        tokens.append(gram if seen[gram] == 1 else "%s\x00%i" % (gram, seen[gram]))
+    return tokens
+
+
+def _candidate_pairs(values: [str], threshold: int, q: int = 2, new: {int} = None):
+    """
+    Generate the pairs of values (as indices) that can be within the edit distance threshold.
+    One edit breaks at most q grams, so two strings within the threshold share one of their
+    first q * threshold + 1 grams in a global order (rarest first). Strings that are too short
+    to have that many grams are compared to all other short strings.
+    When new is given, only the pairs with at least one of those values come out.
+    """
+    if threshold < 0:
+        return
+
+    prefix_length = q * threshold + 1
+    tokens = [_qgram_tokens(value, q) for value in values]
+
+    # Rare grams first, that keeps the inverted lists short
+    frequency = collections.Counter(token for string_tokens in tokens for token in string_tokens)
+
+    # Go from short to long strings, so the inverted lists are sorted on length.
+    # Short strings share the None list. Old values only look in the lists of new values.
+    index: {str: [int]} = {}
+    start: {str: int} = {}
+    new_index: {str: [int]} = {}
+    new_start: {str: int} = {}
+
+    for i in sorted(range(len(values)), key=lambda x: len(values[x])):
+        length = len(values[i])
+        is_new = new is None or i in new
+        lists, starts = (index, start) if is_new else (new_index, new_start)
+        candidates = set()
+
+        keys = sorted(tokens[i], key=lambda token: (frequency[token], token))[:prefix_length]
+        if len(tokens[i]) < prefix_length:
+            keys.append(None)
+
+        for key in keys:
+            entries = lists.get(key, [])
+            first = starts.get(key, 0)
+            # Strings further apart in length than the threshold are never within it
+            while first < len(entries) and length - len(values[entries[first]]) > threshold:
+                first += 1
+            starts[key] = first
+            candidates.update(entries[first:])
+
+            index.setdefault(key, []).append(i)
+            if new is not None and is_new:
+                new_index.setdefault(key, []).append(i)
+
+        for j in candidates:
+            yield j, i
+
+
+# Distinct values in shared memory, attached once in every worker process of _verify_pairs
+_shared_values = None
+
+
+def _attach_values(name: str, count: int) -> None:
+    global _shared_values
+    if sys.version_info >= (3, 13):
+        # The process that created the memory unlinks it, workers only attach
+        memory = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        memory = shared_memory.SharedMemory(name=name)
+    # The buffer starts with count + 1 offsets, followed by the UTF-8 encoded values
+    offsets = np.ndarray((count + 1,), dtype=np.int64, buffer=memory.buf)
+    _shared_values = (memory, offsets, offsets.nbytes)
+    # Worker processes end without atexit handlers, multiprocessing finalizers do run
+    multiprocessing.util.Finalize(None, _detach_values, exitpriority=10)
+
+
+def _detach_values() -> None:
+    global _shared_values
+    if _shared_values is not None:
+        memory = _shared_values[0]
+        # The offsets are a view on the buffer, it can only be closed once they are gone
+        _shared_values = None
+        memory.close()
+
+
+def _pool_context():
+    """Workers are started from a clean server process, forking the threads of the web server is not safe"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _shared_value(i: int) -> str:
+    memory, offsets, base = _shared_values
+    return bytes(memory.buf[base + offsets[i]:base + offsets[i + 1]]).decode("utf-8")
+
+
+def _verify_batch(pairs: np.ndarray, threshold: int) -> [(int, int, int)]:
+    result = []
+    for i, j in pairs.tolist():
+        edit_distance = distance(_shared_value(i), _shared_value(j))
+        if edit_distance <= threshold:
+            result.append((i, j, edit_distance))
+    return result
+
+
+def _verify_pairs(values: [str], pairs, threshold: int, workers: int = 1, batch_size: int = 20000):
+    """
+    Verify candidate pairs with the edit distance, generates (i, j, distance) for the pairs within the threshold.
+    When there are more pairs than fit in one batch, the batches are spread over a pool of processes
+    that read the values from shared memory, so they are not copied to every worker.
+    """
+    pairs = iter(pairs)
+    workers = workers or 1
+    batch = list(itertools.islice(pairs, batch_size))
+
+    if len(batch) < batch_size or workers <= 1:
+        # Not worth starting processes for
+        for i, j in itertools.chain(batch, pairs):
+            edit_distance = distance(values[i], values[j])
+            if edit_distance <= threshold:
+                yield i, j, edit_distance
+        return
+
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+    memory = shared_memory.SharedMemory(create=True, size=max(1, offsets.nbytes + int(offsets[-1])))
+    try:
+        memory.buf[:offsets.nbytes] = offsets.tobytes()
+        memory.buf[offsets.nbytes:offsets.nbytes + int(offsets[-1])] = b"".join(encoded)
+        del encoded
+
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=_pool_context(), initializer=_attach_values,
+                                                    initargs=(memory.name, len(values))) as pool:
+            pending = set()
+            while batch:
+                pending.add(pool.submit(_verify_batch, np.array(batch, dtype=np.int64), threshold))
+                batch = list(itertools.islice(pairs, batch_size))
+
+                # Keep a couple of batches per worker in flight while the next candidates are generated
+                if len(pending) >= 2 * workers or not batch:
+                    done, pending = concurrent.futures.wait(
+                        pending,
+                        return_when=concurrent.futures.FIRST_COMPLETED if batch else concurrent.futures.ALL_COMPLETED
+                    )
+                    for future in done:
+                        yield from future.result()
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+class SimilarityGraph(object):
+    """
+    Distinct strings of a column and the edit distance between every pair within the threshold.
+    Versions of a column mostly share their strings, updating the graph only compares the added ones.
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.values: {str} = set()
+        self.edges: {str: {str: int}} = {}
+
+    def update(self, values: [str], workers: int = None) -> None:
+        """
+        Make the graph describe a new set of distinct strings
+        :param values: Distinct strings
+        :param workers: Amount of processes to verify candidate pairs with
+        """
+        values = list(values)
+        current = set(values)
+
+        # Strings that are gone take their edges with them
+        for removed in self.values - current:
+            for other in self.edges.pop(removed, {}):
+                edges = self.edges[other]
+                del edges[removed]
+                if len(edges) == 0:
+                    del self.edges[other]
+
+        new = {i for i, value in enumerate(values) if value not in self.values}
+        self.values = current
+        if len(new) == 0:
+            return
+
+        # Only pairs with an added string are new, the others are known already
+        pairs = _candidate_pairs(values, self.threshold, new=None if len(new) == len(values) else new)
+        for i, j, edit_distance in _verify_pairs(values, pairs, self.threshold, workers):
+            self.edges.setdefault(values[i], {})[values[j]] = edit_distance
+            self.edges.setdefault(values[j], {})[values[i]] = edit_distance
+
+    def neighbours(self, occurences: {str, int}) -> dict:
+        """
+        Find the most probable duplicate for each string
+        :param occurences: Number of occurences of every string
+        :return: Dict from string to its possible duplicates (itself included), most probable first
+        """
+        duplicates: {str, {str}} = {value: {value, *edges} for value, edges in self.edges.items()}
+        distances_sum: {str, int} = {value: sum(edges.values()) for value, edges in self.edges.items()}
+
+        neighbours: {str, [str]} = {}
+
+        for str_1 in duplicates:
+            # Iterate over each string and sort their neighbours
+            def get_weight(string: str) -> (int, int, str):
+                return occurences[string] * len(duplicates[string]), -distances_sum[string], string
+
+            neighbours[str_1] = sorted(duplicates[str_1], key=get_weight, reverse=True)
+
+        return neighbours
+
+
+def find_duplicates(dataframe: pd.DataFrame, column_name: str, threshold: int, workers: int = None,
+                    graph: SimilarityGraph = None) -> dict:
+    compaction.expand(dataframe, [column_name])
     col: pd.Series = dataframe[column_name]
     if not types.is_string_dtype(col):
         return {}
 
     """
-    Find all possible duplicates for each string in the column, and count for each string the number of occurences
+    Find all possible duplicates for each distinct string in the column, only the pairs that share
+    enough q-grams are compared, by several processes when there are many. The number of occurences comes
+    from one value count. A graph (with the same threshold) of an earlier version of the column
+    is updated in place, so only the strings that were added get compared.
     """
-    duplicates: {str, {str}} = {}
-    occurences: {str, int} = {}
-    distances_sum: {str, int} = {}
+    counts: pd.Series = col.value_counts()
+    values: [str] = [value for value in counts.index if isinstance(value, str)]
+    occurences: {str, int} = {value: int(counts[value]) for value in values}
 
-    for i in range(col.size):
-        str_1: str = col[i]
+    if graph is None:
+        graph = SimilarityGraph(threshold)
+    graph.update(values, workers)
 
-        # Skip if str_1 has been encountered already
-        if str_1 in occurences:
-            continue
-        occurences[str_1] = 1
+    return graph.neighbours(occurences)
 
-        for j in range(i + 1, col.size):
-            str_2: str = col[j]
 
-            # Skip and increase the occurence counter if str_2 is the same as str_1
-            if str_1 == str_2:
-                occurences[str_1] += 1
-                continue
-            # Skip if str_2 has been encountered already
-            if str_2 in occurences:
-                continue
+""" Key collision deduplication """
 
-            # Only use pairs for which the edit distance is below the threshold
-            edit_distance: int = distance(str_1, str_2)
-            if edit_distance <= threshold:
-                # Initialize the duplicate lists if necessary
-                if str_1 not in duplicates:
-                    duplicates[str_1] = {str_1}
-                    distances_sum[str_1] = 0
-                if str_2 not in duplicates:
-                    duplicates[str_2] = {str_2}
-                    distances_sum[str_2] = 0
-                # Add str_1 and str_2 to eachothers duplicate lists
-                duplicates[str_1].add(str_2)
-                duplicates[str_2].add(str_1)
-                distances_sum[str_1] += edit_distance
-                distances_sum[str_2] += edit_distance
-
-    """
-    Find the most probable duplicate for each string
+
+_re_punctuation = re.compile(r"[^\w\s]|_")
+_re_not_word = re.compile(r"[\W_]")
+
+_soundex_codes = {letter: code for code, letters in [("1", "bfpv"), ("2", "cgjkqsxz"), ("3", "dt"),
+                                                     ("4", "l"), ("5", "mn"), ("6", "r")] for letter in letters}
+
+
+def _strip_accents(string: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", string) if not unicodedata.combining(c))
+
+
+def fingerprint(string: str) -> str:
     """
-    neighbours: {str, [str]} = {}
+    Key that is the same for strings that only differ in case, whitespace, punctuation, accents or word order
+    """
+    string = _re_punctuation.sub("", _strip_accents(string.strip().lower()))
+    return " ".join(sorted(set(string.split())))
+
+
+def ngram_fingerprint(string: str, n: int = 2) -> str:
+    """
+    Key from the sorted distinct character n-grams, also matches strings with the spaces in other places
+    """
+    string = _re_not_word.sub("", _strip_accents(string.lower()))
+    return "".join(sorted(set(string[k:k + n] for k in range(len(string) - n + 1))))
+
+
+def _soundex(word: str) -> str:
+    letters = [c for c in word if "a" <= c <= "z"]
+    if len(letters) == 0:
+        return ""
+
+    code = letters[0].upper()
+    last = _soundex_codes.get(letters[0])
+    for letter in letters[1:]:
+        digit = _soundex_codes.get(letter)
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        # Vowels separate equal codes, h and w do not
+        if letter not in "hw":
+            last = digit
+
+    return code.ljust(4, "0")
+
+
+def phonetic_key(string: str) -> str:
+    """
+    Key from the Soundex code of every word, matches words that sound alike
+    """
+    words = _re_punctuation.sub(" ", _strip_accents(string.lower())).split()
+    return " ".join(code for code in (_soundex(word) for word in words) if code != "")
+
+
+# Methods to deduplicate with besides edit distance, each computes a key for a string
+KEY_METHODS = {
+    "fingerprint": fingerprint,
+    "ngram_fingerprint": ngram_fingerprint,
+    "phonetic": phonetic_key,
+}
+
+
+def find_key_collisions(dataframe: pd.DataFrame, column_name: str, method: str) -> dict:
+    """
+    Find duplicates as the distinct strings that get the same key, in one pass over the distinct values.
+    The result has the same format as find_duplicates, every string of a group lists the whole group,
+    most frequent string first.
+    """
+    compaction.expand(dataframe, [column_name])
+    col: pd.Series = dataframe[column_name]
+    if not types.is_string_dtype(col):
+        return {}
+
+    counts: pd.Series = col.value_counts()
+    values = pd.Series([value for value in counts.index if isinstance(value, str)])
+    keys = values.map(KEY_METHODS[method])
 
-    for str_1 in duplicates:
-        # Iterate over each string and sort their neighbours
-        def get_weight(string: str) -> (int, int, str):
-            return occurences[string] * len(duplicates[string]), -distances_sum[string], string
+    neighbours: {str, [str]} = {}
+    for key, group in values.groupby(keys.values):
+        # Strings without anything to build a key from are not alike
+        if key == "" or len(group) < 2:
+            continue
 
-        neighbours[str_1] = sorted(duplicates[str_1], key=get_weight, reverse=True)
+        ordered = sorted(group, key=lambda string: (counts[string], string), reverse=True)
+        for string in ordered:
+            neighbours[string] = ordered
 
     return neighbours
 
 
+def _resolve_chains(to_replace: {str, str}) -> {str, str}:
+    """
+    Follow the replacements through, so every string maps to the end of its chain.
+    Strings are grouped with union-find, every group either has exactly one string that is not replaced
+    itself, which all others end up at, or it has a cycle and then nothing in it is replaced.
+    """
+    parent: {str, str} = {}
+
+    def find(string: str) -> str:
+        root = string
+        while parent.setdefault(root, root) != root:
+            root = parent[root]
+        # Path compression
+        while parent[string] != root:
+            parent[string], string = root, parent[string]
+        return root
+
+    for string, replacement in to_replace.items():
+        root_1, root_2 = find(string), find(replacement)
+        if root_1 != root_2:
+            parent[root_1] = root_2
+
+    # The end of the chain of a group is its only member that is not replaced itself
+    ends: {str, str} = {}
+    for string in parent:
+        if string not in to_replace:
+            ends[find(string)] = string
+
+    resolved: {str, str} = {}
+    for string in to_replace:
+        root = find(string)
+        if root in ends:
+            resolved[string] = ends[root]
+
+    return resolved
+
+
 def replace_duplicates(dataframe: pd.DataFrame, column_name: str, to_replace: {str, str}, chain: bool) -> pd.DataFrame:
+    compaction.expand(dataframe, [column_name])
     col = dataframe[column_name]
     if not types.is_string_dtype(col):
         return dataframe
 
     if chain:
-        new_dict: {str, str} = {}
-        for string in to_replace:
-            new_dict[string] = to_replace[string]
-            while new_dict[string] in to_replace:
-                new_dict[string] = to_replace[new_dict[string]]
-                if new_dict[string] == string:
-                    del new_dict[string]
-                    break
-        to_replace = new_dict
-
-    for i in range(col.size):
-        if col[i] in to_replace:
-            col[i] = to_replace[col[i]]
-        dataframe[column_name] = col
+        to_replace = _resolve_chains(to_replace)
 
+    # Replace every distinct value once, then spread the result over the rows
+    codes, uniques = pd.factorize(col)
+    replaced = np.array([to_replace.get(value, value) for value in uniques], dtype=object)
+
+    values = replaced.take(codes)
+    # Missing values have code -1, keep them as they were
+    missing = codes < 0
+    values[missing] = col.values[missing]
+
+    dataframe[column_name] = pd.Series(values, index=col.index)
     return dataframe
 
 
+""" Record linkage """
+
+
+def _blocking_key(dataframe: pd.DataFrame, spec: str) -> pd.Series:
+    """
+    Get the blocking key of every row. A spec is one or more parts joined with '+', every part is
+    a column name, optionally followed by ':<n>' to only use the first n characters.
+    Rows with an empty part get no key and are not blocked by this spec.
+    """
+    parts = []
+    for part in spec.split("+"):
+        column_name, _, length = part.partition(":")
+        col = dataframe[column_name]
+        key = col.astype(str).str.strip().str.lower()
+        if length:
+            key = key.str[:int(length)]
+        parts.append(key.where(col.notnull()))
+
+    return parts[0] if len(parts) == 1 else parts[0].str.cat(parts[1:], sep="\x1f")
+
+
+def _record_pairs(dataframe: pd.DataFrame, blocking: [str], sort_column: str, window: int):
+    """
+    Generate the pairs of rows (as positions) that share a blocking key. Rows in a block are all compared
+    with each other, unless the block is bigger than the window, then every row is only compared with
+    the next rows within the window in sorted order. That keeps the amount of pairs near-linear.
+    """
+    positions = pd.Series(np.arange(len(dataframe)))
+    sort_values = dataframe[sort_column].astype(str).str.lower().values
+    # Keys of every earlier spec, with the keys of its blocks that were compared all with all
+    previous_keys = []
+
+    for spec in blocking:
+        key = _blocking_key(dataframe, spec)
+        complete = set()
+        for block_key, group in positions.groupby(key.values):
+            members = group.values.tolist()
+            if len(members) > window:
+                members.sort(key=lambda x: sort_values[x])
+            else:
+                complete.add(block_key)
+
+            for k, i in enumerate(members):
+                for j in members[k + 1:k + window]:
+                    # Pairs in a block of an earlier spec that was compared all with all had their chance already,
+                    # pairs in a windowed block may never have been compared
+                    if any(keys[i] == keys[j] and keys[i] in blocks for keys, blocks in previous_keys):
+                        continue
+                    yield (i, j) if i < j else (j, i)
+
+        # Missing keys become NaN, which is never equal to anything
+        previous_keys.append((key.tolist(), complete))
+
+
+def find_record_duplicates(dataframe: pd.DataFrame, fields: {str, float}, blocking: [str], threshold: float,
+                           window: int = 50) -> [list]:
+    """
+    Find rows that describe the same thing, by comparing several columns at once.
+    Only rows that share a blocking key are compared. Their similarity is the weighted mean of the field
+    similarities: 1 - edit distance / length for strings, equality for everything else. Fields that are
+    empty in one of both rows do not count. Rows that are at least threshold similar end up in one cluster.
+    :return: Clusters of row labels, biggest first
+    """
+    names = list(fields)
+    compaction.expand(dataframe, names)
+    weights = [float(fields[name]) for name in names]
+    columns = [dataframe[name].tolist() for name in names]
+    strings = [types.is_string_dtype(dataframe[name]) for name in names]
+    missing = [dataframe[name].isnull().tolist() for name in names]
+
+    parent = list(range(len(dataframe)))
+
+    def find(x: int) -> int:
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for i, j in _record_pairs(dataframe, blocking, names[0], window):
+        total = 0.0
+        score = 0.0
+        for f in range(len(names)):
+            if missing[f][i] or missing[f][j]:
+                continue
+            a, b = columns[f][i], columns[f][j]
+            if strings[f] and isinstance(a, str) and isinstance(b, str):
+                longest = max(len(a), len(b))
+                similarity = 1.0 - distance(a, b) / longest if longest > 0 else 1.0
+            else:
+                similarity = 1.0 if a == b else 0.0
+            score += weights[f] * similarity
+            total += weights[f]
+
+        if total > 0 and score / total >= threshold:
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parent[root_i] = root_j
+
+    groups: {int, [int]} = {}
+    for i in range(len(dataframe)):
+        groups.setdefault(find(i), []).append(i)
+
+    clusters = [[dataframe.index[i] for i in group] for group in groups.values() if len(group) > 1]
+    return sorted(clusters, key=len, reverse=True)
+
+
+def merge_record_duplicates(dataframe: pd.DataFrame, clusters: [list]) -> pd.DataFrame:
+    """
+    Keep one row of every cluster, the one with the most filled in values (the first one on a tie)
+    """
+    filled = dataframe.notnull().sum(axis=1)
+
+    drop = []
+    for cluster in clusters:
+        keep = max(cluster, key=lambda label: filled[label])
+        drop.extend(label for label in cluster if label != keep)
+
+    return dataframe.drop(drop)
+
+
 """ Testing """
 
 
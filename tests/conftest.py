@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules of the app are imported from the src folder, like app.py does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,81 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+import compaction
+
+
+KINDS = {"id": "integer", "count": "integer", "score": "float", "name": "string", "flag": "boolean",
+         "when": "datetime"}
+
+
+def _table(rows: int, seed: int = 0) -> pd.DataFrame:
+    """A table the way pandas reads it from the database, integers with nulls are floats"""
+    random = np.random.RandomState(seed)
+    count = random.randint(0, 300, rows).astype(np.float64)
+    count[random.rand(rows) < 0.1] = np.nan
+    name = np.array(["alpha", "beta", "gamma", "delta"], dtype=object)[random.randint(0, 4, rows)]
+    name[random.rand(rows) < 0.1] = None
+
+    return pd.DataFrame({
+        "id": np.arange(rows, dtype=np.int64),
+        "count": count,
+        "score": random.randint(0, 8, rows) / 4,
+        "name": pd.Series(name, dtype=object),
+        "flag": random.rand(rows) < 0.5,
+        "when": pd.Timestamp("2020-01-01") + pd.to_timedelta(random.randint(0, 1000, rows), unit="D"),
+    })
+
+
+def test_compact_expand_round_trip():
+    table = _table(1000)
+    compacted = compaction.compact(table.copy(), KINDS)
+
+    assert str(compacted["id"].dtype) == "Int16"
+    assert str(compacted["count"].dtype) == "Int16"
+    assert str(compacted["score"].dtype) == "float32"
+    assert str(compacted["name"].dtype) == "category"
+    assert str(compacted["flag"].dtype) == "boolean"
+
+    pd.testing.assert_frame_equal(compaction.expand(compacted), table)
+
+
+def test_compact_chunks_matches_whole_table():
+    table = _table(1000)
+    chunks = [table.iloc[start:start + 128].reset_index(drop=True) for start in range(0, len(table), 128)]
+
+    compacted = compaction.compact_chunks(chunks, KINDS)
+
+    pd.testing.assert_frame_equal(compaction.expand(compacted), table)
+
+
+def test_compact_chunks_widens_integers():
+    chunks = [pd.DataFrame({"id": np.arange(10, dtype=np.int64)}),
+              pd.DataFrame({"id": np.arange(100000, 100010, dtype=np.int64)})]
+
+    compacted = compaction.compact_chunks(chunks, {"id": "integer"})
+
+    assert str(compacted["id"].dtype) == "Int32"
+    assert compacted["id"].tolist() == list(range(10)) + list(range(100000, 100010))
+
+
+def test_many_distinct_strings_are_not_categorical():
+    table = pd.DataFrame({"name": pd.Series(["value %i" % i for i in range(100)], dtype=object)})
+    chunks = [table.iloc[start:start + 10].reset_index(drop=True) for start in range(0, 100, 10)]
+
+    compacted = compaction.compact_chunks(chunks, {"name": "string"}, max_categories=25)
+
+    assert str(compacted["name"].dtype) != "category"
+    pd.testing.assert_frame_equal(compaction.expand(compacted), table)
+
+
+def test_compact_without_chunks():
+    assert compaction.compact_chunks([], KINDS) is None
+
+
+def test_expand_nullable_keeps_integers():
+    series = pd.Series([1, None, 3], dtype="Int8")
+
+    assert compaction.expand_series(series).dtype == np.float64
+    assert str(compaction.expand_series(series, nullable=True).dtype) == "Int64"
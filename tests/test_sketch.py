@@ -0,0 +1,74 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+
+import sketch
+
+
+def test_hyperloglog_error():
+    hll = sketch.HyperLogLog()
+    values = np.arange(200000)
+    # Chunks that overlap, values seen before do not count again
+    for start in range(0, len(values), 30000):
+        hll.update(pd.Series(values[start:start + 40000]))
+
+    assert abs(hll.estimate() - len(values)) <= 0.03 * len(values)
+
+
+def test_hyperloglog_small_and_merged():
+    first, second = sketch.HyperLogLog(), sketch.HyperLogLog()
+    first.update(pd.Series(["a", "b", "c"] * 10))
+    second.update(pd.Series(["c", "d"]))
+    first.merge(second)
+
+    assert first.estimate() == 4
+
+
+def test_quantile_sketch_rank_error():
+    random = np.random.RandomState(1)
+    values = random.normal(size=100000)
+    quantiles = sketch.QuantileSketch(k=200, seed=1)
+    for chunk in np.array_split(values, 17):
+        quantiles.update(chunk)
+
+    fractions = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+    ordered = np.sort(values)
+    for fraction, quantile in zip(fractions, quantiles.quantiles(fractions)):
+        rank = np.searchsorted(ordered, quantile) / len(values)
+        assert abs(rank - fraction) <= 0.03
+
+    # It keeps a few levels of items instead of all numbers
+    assert sum(len(items) for items in quantiles.levels) < 2000
+
+
+def test_quantile_sketch_empty():
+    assert sketch.QuantileSketch().quantiles([0.5]) == [None]
+
+
+def test_topk_bounds():
+    random = np.random.RandomState(2)
+    values = pd.Series(random.zipf(1.5, 50000) % 1000)
+    top = sketch.TopK(capacity=50)
+    for start in range(0, len(values), 5000):
+        top.update(values.iloc[start:start + 5000])
+
+    true_counts = values.value_counts()
+    bound = len(values) / (top.capacity + 1)
+    for value, count in top.top(10):
+        assert true_counts[value] - bound <= count <= true_counts[value]
+    # The most frequent value is never missed
+    assert top.top(1)[0][0] == true_counts.index[0]
+
+
+def test_moments_match_numpy():
+    random = np.random.RandomState(3)
+    values = random.exponential(size=10001)
+    moments = sketch.Moments()
+    for chunk in np.array_split(values, 7):
+        moments.update(chunk)
+
+    assert moments.count == len(values)
+    assert moments.mean == pytest.approx(values.mean())
+    assert moments.std() == pytest.approx(values.std(ddof=1))
+    assert (moments.min, moments.max) == (values.min(), values.max())
@@ -0,0 +1,215 @@
+import itertools
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("Levenshtein")
+
+import transform
+
+
+def _edit_distance(a: str, b: str) -> int:
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def _random_strings(generator: random.Random, amount: int) -> [str]:
+    # Few letters and short strings, so there are plenty of pairs within the threshold
+    strings = {"".join(generator.choice("abcd") for _ in range(generator.randint(0, 7))) for _ in range(amount)}
+    return sorted(strings)
+
+
+def _within(values: [str], threshold: int) -> {(int, int)}:
+    return {(i, j) for i, j in itertools.combinations(range(len(values)), 2)
+            if _edit_distance(values[i], values[j]) <= threshold}
+
+
+""" Deduplication """
+
+
+@pytest.mark.parametrize("threshold", [0, 1, 2, 3])
+def test_candidate_pairs_finds_all_pairs(threshold):
+    generator = random.Random(threshold)
+    for _ in range(20):
+        values = _random_strings(generator, 60)
+        candidates = {tuple(sorted(pair)) for pair in transform._candidate_pairs(values, threshold)}
+
+        assert _within(values, threshold) <= candidates
+
+
+@pytest.mark.parametrize("threshold", [1, 2])
+def test_candidate_pairs_of_new_values(threshold):
+    generator = random.Random(10 + threshold)
+    for _ in range(20):
+        values = _random_strings(generator, 60)
+        new = set(generator.sample(range(len(values)), len(values) // 4))
+        candidates = {tuple(sorted(pair)) for pair in transform._candidate_pairs(values, threshold, new=new)}
+
+        assert {pair for pair in _within(values, threshold) if new & set(pair)} <= candidates
+        assert all(new & set(pair) for pair in candidates)
+
+
+def test_similarity_graph_update_matches_fresh_graph():
+    generator = random.Random(20)
+    graph = transform.SimilarityGraph(2)
+    values = _random_strings(generator, 80)
+
+    for _ in range(10):
+        # Every version keeps most strings, drops some and adds some
+        kept = [value for value in values if generator.random() < 0.8]
+        values = sorted(set(kept) | set(_random_strings(generator, 20)))
+        graph.update(values)
+
+        fresh = transform.SimilarityGraph(2)
+        fresh.update(values)
+        assert graph.values == fresh.values
+        assert graph.edges == fresh.edges
+
+        expected = {(values[i], values[j]) for i, j in _within(values, 2)}
+        assert {(a, b) for a in graph.edges for b in graph.edges[a] if a < b} == expected
+
+
+def test_find_duplicates():
+    dataframe = pd.DataFrame({"name": ["Jansen", "Janssen", "Jansen", "Peeters", None]})
+    neighbours = transform.find_duplicates(dataframe, "name", 1)
+
+    assert neighbours == {"Jansen": ["Jansen", "Janssen"], "Janssen": ["Jansen", "Janssen"]}
+
+
+def test_record_pairs_after_windowed_block():
+    dataframe = pd.DataFrame({"city": ["x", "x", "x", "x"], "zip": ["1", "2", "3", "1"],
+                              "name": ["aaa", "bbb", "ccc", "zzz"]})
+
+    # The city block is bigger than the window, so rows 0 and 3 are only compared through their zip
+    pairs = list(transform._record_pairs(dataframe, ["city", "zip"], "name", 2))
+    assert sorted(pairs) == [(0, 1), (0, 3), (1, 2), (2, 3)]
+
+    # Blocks that were compared all with all are not compared again
+    pairs = list(transform._record_pairs(dataframe, ["zip", "city"], "name", 10))
+    assert sorted(pairs) == [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
+
+
+""" Key collisions """
+
+
+def test_fingerprint():
+    assert transform.fingerprint("  Smith, Tom. ") == transform.fingerprint("tom smith")
+    assert transform.fingerprint("Café  Noir") == "cafe noir"
+    assert transform.fingerprint("a b a") == "a b"
+    assert transform.ngram_fingerprint("New York") == transform.ngram_fingerprint("newyork")
+
+
+@pytest.mark.parametrize("word, code", [
+    ("robert", "R163"), ("rupert", "R163"), ("rubin", "R150"), ("ashcraft", "A261"), ("tymczak", "T522"),
+    ("pfister", "P236"), ("honeyman", "H555"), ("a", "A000"), ("", ""), ("123", ""),
+])
+def test_soundex(word, code):
+    assert transform._soundex(word) == code
+
+
+def test_phonetic_key():
+    assert transform.phonetic_key("Robert Smith") == transform.phonetic_key("Rupert Smyth") == "R163 S530"
+
+
+""" Discretization """
+
+
+@pytest.mark.parametrize("values", [[1.0, 2.5, 7.0, 10.0], [-3.0, -3.0, 4.0], [5.0, 5.0], [0.0], [-2.0, -2.0]])
+@pytest.mark.parametrize("nr_bins", [1, 3, 10])
+def test_equiwidth_bins_match_cut(values, nr_bins):
+    _, expected = pd.cut(pd.Series(values), nr_bins, retbins=True)
+
+    np.testing.assert_allclose(transform._equiwidth_bins(min(values), max(values), nr_bins), expected)
+
+
+def test_discretize_equiwidth_in_chunks():
+    values = pd.Series(np.random.RandomState(0).uniform(-5, 20, 1000))
+    whole = transform.discretize_equiwidth(pd.DataFrame({"x": values}), "x", 7)
+
+    chunks = [transform.discretize_equiwidth(pd.DataFrame({"x": values[start:start + 100]}), "x", 7,
+                                             values.min(), values.max())
+              for start in range(0, len(values), 100)]
+
+    pd.testing.assert_frame_equal(pd.concat(chunks), whole)
+
+
+""" Type changing """
+
+
+def test_change_type_int_keeps_nulls():
+    dataframe = pd.DataFrame({"x": ["1.5", None, "2", "2.5", "-0.5"]})
+    result = transform.change_type(dataframe, "x", "int")["x"]
+
+    assert str(result.dtype) == "Int64"
+    # Half to even, like round()
+    assert result.tolist() == [2, pd.NA, 2, 2, 0]
+
+
+def test_change_type_float():
+    dataframe = pd.DataFrame({"x": ["1.5", None, "2", "1.5"]})
+    result = transform.change_type(dataframe, "x", "float")["x"]
+
+    assert result.dtype == np.float64
+    np.testing.assert_array_equal(result.values, [1.5, np.nan, 2.0, 1.5])
+
+
+def test_change_type_int_from_floats():
+    dataframe = pd.DataFrame({"x": [0.5, 1.5, np.nan]})
+
+    assert transform.change_type(dataframe, "x", "int")["x"].tolist() == [0, 2, pd.NA]
+
+
+@pytest.mark.parametrize("strings, expected", [
+    (["2020-12-31", None, "2021-02-01"], ["2020-12-31", None, "2021-02-01"]),
+    (["2020-12-31 13:45:00", "2021-02-01 00:00:01"], ["2020-12-31 13:45:00", "2021-02-01 00:00:01"]),
+    # Month first like pd.to_datetime, unless a day does not fit as month
+    (["02/01/2021", "03/04/2021"], ["2021-02-01", "2021-03-04"]),
+    (["31/12/2020", "01/02/2021", None], ["2020-12-31", "2021-02-01", None]),
+    (["31.12.2020", "1.2.2021"], ["2020-12-31", "2021-02-01"]),
+    (["31 December 2020", "1 February 2021"], ["2020-12-31", "2021-02-01"]),
+    (["20201231", "20210201"], ["2020-12-31", "2021-02-01"]),
+])
+def test_change_type_datetime_formats(strings, expected):
+    dataframe = pd.DataFrame({"x": strings})
+    result = transform.change_type(dataframe, "x", "datetime")["x"]
+
+    pd.testing.assert_series_equal(result, pd.Series(pd.to_datetime(expected), name="x").astype("datetime64[ns]"))
+
+
+def test_change_type_datetime_mixed_formats():
+    # What does not fit the format of the sample is parsed on its own
+    dates = pd.date_range("2020-01-01", periods=150)
+    dataframe = pd.DataFrame({"x": dates.strftime("%Y-%m-%d").tolist() * 2 + ["Feb 1, 2021", None]})
+    result = transform.change_type(dataframe, "x", "datetime")["x"]
+
+    assert result[:150].tolist() == dates.tolist()
+    assert result.iloc[-2] == pd.Timestamp("2021-02-01")
+    assert pd.isnull(result.iloc[-1])
+
+
+def test_change_type_datetime_mixed_formats_in_sample():
+    # No format fits the whole sample, every value is parsed on its own
+    dataframe = pd.DataFrame({"x": ["2020-01-03", None, "2020-02-01", "March 3, 2020", "2020-01-03"]})
+    result = transform.change_type(dataframe, "x", "datetime")["x"]
+
+    expected = pd.to_datetime(["2020-01-03", None, "2020-02-01", "2020-03-03", "2020-01-03"])
+    pd.testing.assert_series_equal(result, pd.Series(expected, name="x").astype("datetime64[ns]"))
+
+
+def test_change_type_datetime_given_format():
+    # Chunks of a column are all parsed with the format guessed once for the whole column
+    date_format = transform.guess_datetime_format(["01/02/2021", "31/12/2020"])
+    dataframe = pd.DataFrame({"x": ["03/04/2021", None]})
+    result = transform.change_type(dataframe, "x", "datetime", date_format)["x"]
+
+    assert date_format == "%d/%m/%Y"
+    assert result.iloc[0] == pd.Timestamp("2021-04-03")
+    assert pd.isnull(result.iloc[1])
+    assert transform.guess_datetime_format(["2020-01-03", "March 3, 2020"]) == transform.NO_DATETIME_FORMAT